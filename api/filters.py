@@ -0,0 +1,77 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import F
+from rest_framework import filters
+
+
+class PrefixSearchQuery(SearchQuery):
+    """SearchQuery taking a to_tsquery expression, such as 'bandej:* & azul:*',
+    instead of plain text."""
+
+    def as_sql(self, compiler, connection):
+        sql, params = super().as_sql(compiler, connection)
+        return sql.replace('plainto_tsquery(', 'to_tsquery(', 1), params
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """Full Text Search Filter
+    ranked search over the full text indexes created by the datasets migrations
+
+    on Postgres it matches and ranks the trigger maintained search_vector
+    column with the portuguese configuration, on SQLite it goes through the
+    FTS5 table of the model. Anywhere else, or for models without a full text
+    index, it does the usual SearchFilter lookups
+
+    both backends match the same way: every word of the search must start a
+    word of the spotted, so that partial words still match
+
+    results come best first, unless an ordering is asked for
+    """
+
+    config = 'portuguese'
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+
+        connection = connections[queryset.db]
+        model = queryset.model
+        words = search_words(terms)
+        if words and connection.vendor == 'postgresql' and any(f.name == 'search_vector' for f in model._meta.fields):
+            query = PrefixSearchQuery(' & '.join(word + ':*' for word in words), config=self.config)
+            return queryset.filter(search_vector=query).annotate(rank=SearchRank(F('search_vector'), query)).order_by('-rank', '-created')
+
+        if words and connection.vendor == 'sqlite' and has_fts_table(connection, model):
+            table = model._meta.db_table
+            match = ' '.join(f'"{word}"*' for word in words)
+            return queryset.extra(
+                tables=[table + '_fts'],
+                where=[f'{table}_fts.rowid = {table}.id', f'{table}_fts MATCH %s'],
+                params=[match],
+                select={'rank': f'{table}_fts.rank'},
+                order_by=['rank'],
+            )
+
+        return super().filter_queryset(request, queryset, view)
+
+
+def search_words(terms):
+    """Search Words
+    returns the words of the search terms, leaving out anything the full text
+    query syntax of either backend would read as an operator
+    """
+    return [word for term in terms for word in re.findall(r'\w+', term)]
+
+
+_fts_tables = {}
+
+
+def has_fts_table(connection, model):
+    key = (connection.alias, model._meta.db_table)
+    if key not in _fts_tables:
+        with connection.cursor() as cursor:
+            _fts_tables[key] = model._meta.db_table + '_fts' in connection.introspection.table_names(cursor)
+    return _fts_tables[key]
@@ -0,0 +1,136 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Keyset Pagination
+    pages through (created, id), continuing after the last row of the previous
+    page instead of skipping offset rows, so every page costs the same
+
+    `cursor` is the opaque position returned as `next` or `previous`, `limit`
+    the page size and `count=false` skips counting the whole list. Requests
+    that order or search, or still use `offset`, get the usual limit/offset pages
+    """
+
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 1000
+    limit_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    ordering = ('-created', '-id')
+    fallback_query_params = ('ordering', 'search', 'offset')
+    fallback_class = LimitOffsetPagination
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.fallback = None
+        if any(param in request.query_params for param in self.fallback_query_params):
+            self.fallback = self.fallback_class()
+            return self.fallback.paginate_queryset(queryset, request, view)
+
+        self.request = request
+        limit = self.get_limit(request)
+        self.count = queryset.count() if self.get_count(request) else None
+
+        position, reverse = self.decode_cursor(request)
+        # Previous pages are read backwards from the first row of the page after them
+        ordering = self.ordering if not reverse else [self.reverse_field(field) for field in self.ordering]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(position, reverse))
+
+        # One extra row tells whether there is a page further on
+        rows = list(queryset[:limit + 1])
+        more, rows = len(rows) > limit, rows[:limit]
+        if reverse:
+            rows.reverse()
+            self.previous_position = self.position(rows[0]) if more else None
+            self.next_position = self.position(rows[-1]) if rows else None
+        else:
+            self.previous_position = self.position(rows[0]) if position is not None and rows else None
+            self.next_position = self.position(rows[-1]) if more else None
+        return rows
+
+    def get_paginated_response(self, data):
+        if self.fallback is not None:
+            return self.fallback.get_paginated_response(data)
+
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(limit, self.max_page_size) if limit > 0 else self.page_size
+
+    def get_count(self, request):
+        return request.query_params.get(self.count_query_param, 'true').lower() != 'false'
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.encode_cursor(self.previous_position, reverse=True))
+
+    def reverse_field(self, field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    def position(self, row):
+        if isinstance(row, dict):
+            return tuple(row[field.lstrip('-')] for field in self.ordering)
+        return tuple(getattr(row, field.lstrip('-')) for field in self.ordering)
+
+    def after(self, position, reverse=False):
+        """After
+        returns the filter for the rows that come after position, or before
+        it when reverse
+        """
+        (created_field, id_field), (created, id) = [field.lstrip('-') for field in self.ordering], position
+        lookup = 'lt' if self.ordering[0].startswith('-') != reverse else 'gt'
+        return Q(**{f'{created_field}__{lookup}': created}) | Q(**{created_field: created, f'{id_field}__{lookup}': id})
+
+    def encode_cursor(self, position, reverse=False):
+        created, id = position
+        cursor = [created.isoformat(), id] + ([1] if reverse else [])
+        return base64.urlsafe_b64encode(json.dumps(cursor).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, request):
+        """Decode Cursor
+        returns the position of the cursor and wether it points backwards,
+        (None, False) without a cursor
+        """
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            created, id, *reverse = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+            created = parse_datetime(created)
+            if created is None or reverse not in ([], [1]):
+                raise ValueError
+            return (created, int(id)), bool(reverse)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class OldestFirstKeysetPagination(KeysetPagination):
+    ordering = ('created', 'id')
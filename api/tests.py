@@ -1,3 +1,357 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from chatbot.models import Chat
+from datasets.models import Approved, Deleted, Pending, Rejected, count_spotteds
+from processing import duplicates, learning
+
+from .filters import PrefixSearchQuery, search_words
+from .views import ProcessNewSpottedBatch
+
+
+def install_models():
+    """Makes tiny fitted models resident, so views never load or fit real ones."""
+    examples = [
+        ('linda gata amor', 'aprovado', None),
+        ('oi linda te amo', 'aprovado', None),
+        ('compre spam barato', 'rejeitado', 'Spam'),
+        ('burro ofensivo idiota', 'rejeitado', 'Ofensivo'),
+        ('spam compre agora', 'rejeitado', 'Spam'),
+    ]
+    learning.reset_models()
+    for detailed in (False, True):
+        model = learning.SpottedAnalyzer('nb', detailed)
+        data = [(message, reason if detailed else label) for message, label, reason in examples if not detailed or reason]
+        model.pipeline = learning.build_pipeline('nb').fit(*zip(*data))
+        model.version = 'test'
+        learning._models[('nb', detailed)] = model
+    learning._models[('nb', 'combined')] = False
+
+
+@override_settings(SPOTTED_CLASSIFIER='nb', DUPLICATE_DETECTION=False, DEFERRED_WRITES=False)
+class ProcessNewSpottedBatchTests(TestCase):
+
+    def setUp(self):
+        install_models()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('page', 'page@example.com', 'pw'))
+        self.url = reverse('api:process_new_posts_batch')
+
+    def tearDown(self):
+        learning.reset_models()
+
+    def post(self, messages):
+        return self.client.post(self.url, {'messages': messages}, format='json')
+
+    def test_answers_every_spotted_in_order_with_its_id(self):
+        messages = [
+            {'message': 'linda gata amor', 'is_safe': True},
+            {'message': 'compre spam barato', 'is_safe': 'false'},
+            {'message': 'linda gata com foto', 'is_safe': 'True', 'has_attachment': 'TRUE'},
+        ]
+        response = self.post(messages)
+
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual(len(results), 3)
+        for result in results:
+            self.assertIsNotNone(result['api_id'])
+        models = {'approve': Approved, 'reject': Rejected, 'moderation': Pending}
+        for result, data in zip(results, messages):
+            saved = models[result['action']].objects.get(id=result['api_id'])
+            self.assertEqual(saved.message, data['message'])
+
+    def test_accepts_messages_as_a_json_string(self):
+        response = self.client.post(self.url, {'messages': '[{"message": "oi linda", "is_safe": "true"}]'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_rejects_invalid_json(self):
+        response = self.client.post(self.url, {'messages': '[{"message": '})
+        self.assertEqual(response.status_code, 400)
+
+    def test_rejects_empty_and_oversized_batches(self):
+        self.assertEqual(self.post([]).status_code, 400)
+
+        messages = [{'message': f'spotted {i}', 'is_safe': True} for i in range(3)]
+        with mock.patch.object(ProcessNewSpottedBatch, 'max_messages', 2):
+            self.assertEqual(self.post(messages).status_code, 400)
+        self.assertEqual(Pending.objects.count() + Approved.objects.count() + Rejected.objects.count(), 0)
+
+    def test_booleans_are_parsed_strictly(self):
+        response = self.post([{'message': 'oi linda', 'is_safe': '__import__("os")'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('is_safe', response.data['messages'][0])
+
+        response = self.post([{'message': 'oi linda', 'is_safe': True}, {'message': 'oi linda', 'is_safe': True, 'has_attachment': 1}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('has_attachment', response.data['messages'][1])
+
+    def test_malformed_spotteds_name_their_index(self):
+        valid = {'message': 'oi linda', 'is_safe': True}
+        cases = [
+            (['oi linda'], None),
+            ([valid, {'is_safe': True}], 'message'),
+            ([valid, valid, {'message': 'oi linda'}], 'is_safe'),
+            ([{'message': ['oi'], 'is_safe': True}], 'message'),
+        ]
+        for messages, field in cases:
+            with self.subTest(messages):
+                response = self.post(messages)
+                self.assertEqual(response.status_code, 400)
+                index = len(messages) - 1
+                self.assertEqual(list(response.data['messages']), [index])
+                if field:
+                    self.assertIn(field, response.data['messages'][index])
+        self.assertEqual(Pending.objects.count() + Approved.objects.count() + Rejected.objects.count(), 0)
+
+        response = self.client.post(reverse('api:process_new_post'), {'is_safe': True}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('message', response.data)
+
+
+@override_settings(SPOTTED_CLASSIFIER='nb', DUPLICATE_DETECTION=True, DUPLICATE_THRESHOLD=0.8, DEFERRED_WRITES=False)
+class DuplicateSpottedTests(TestCase):
+
+    def setUp(self):
+        install_models()
+        duplicates._index = duplicates.DuplicateIndex()
+        self.original = Approved.objects.create(message='alguém viu a menina de vestido azul no bandejão hoje?')
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('page', 'page@example.com', 'pw'))
+
+    def tearDown(self):
+        duplicates._index = None
+        learning.reset_models()
+
+    def test_reposts_go_to_moderation_with_a_consistent_answer(self):
+        response = self.client.post(reverse('api:process_new_posts_batch'), {'messages': [
+            {'message': 'Alguém viu a menina de vestido azul no bandejão hoje??', 'is_safe': True},
+            {'message': 'compre spam barato', 'is_safe': True},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        repost, other = response.data['results']
+
+        self.assertEqual(repost['action'], 'moderation')
+        self.assertEqual(repost['suggestion'], 'Repetido')
+        self.assertIsNone(repost['confidence'])
+        self.assertEqual(repost['duplicate_of']['api_id'], self.original.id)
+        self.assertGreaterEqual(repost['duplicate_of']['similarity'], 0.8)
+        self.assertEqual(Pending.objects.get(id=repost['api_id']).suggestion, 'Repetido')
+
+        self.assertIsNone(other['duplicate_of'])
+        self.assertIsInstance(other['confidence'], float)
+
+
+class FullTextSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        Approved.objects.bulk_create([
+            Approved(message='Alguém viu a menina de vestido azul no bandejão?'),
+            Approved(message='O crush do ciclo básico usa vestido'),
+            Approved(message='Perdi meu guarda-chuva azul'),
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def search(self, search):
+        response = self.client.get(reverse('api:list_approved'), {'search': search})
+        self.assertEqual(response.status_code, 200)
+        return sorted(row['message'] for row in response.data['results'])
+
+    def test_every_word_matches_as_a_prefix(self):
+        self.assertEqual(self.search('bandej'), ['Alguém viu a menina de vestido azul no bandejão?'])
+        self.assertEqual(self.search('vestido azul'), ['Alguém viu a menina de vestido azul no bandejão?'])
+        self.assertEqual(self.search('vest'), ['Alguém viu a menina de vestido azul no bandejão?', 'O crush do ciclo básico usa vestido'])
+        self.assertEqual(self.search('vestidos'), [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.search('"azul" -guarda*'), ['Perdi meu guarda-chuva azul'])
+        self.assertEqual(self.search('!!!'), [])
+
+    def test_postgres_uses_the_same_prefix_rule(self):
+        self.assertEqual(search_words(['vestido', 'azul!', "guarda-chuva's"]), ['vestido', 'azul', 'guarda', 'chuva', 's'])
+
+        query = PrefixSearchQuery('vestido:* & azul:*', config='portuguese')
+        compiler = mock.Mock(compile=lambda config: ('%s', ['portuguese']))
+        sql, params = query.as_sql(compiler, connection)
+        self.assertTrue(sql.startswith('to_tsquery('), sql)
+        self.assertEqual(params, ['portuguese', 'vestido:* & azul:*'])
+
+
+class HarumiTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        Approved.objects.create(message='spotted')
+        Approved.objects.create(message='de outra página', origin='outra')
+        Rejected.objects.bulk_create([Rejected(message='spam', reason='Spam'), Rejected(message='mais spam', reason='Spam')])
+        Deleted.objects.create(message='apagado', reason='Me arrependi', by='author')
+        Pending.objects.create(message='moderar')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def get(self, **params):
+        response = self.client.get(reverse('api:harumi'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_totals_come_from_the_counters(self):
+        # bulk_create is not counted, only the spotteds saved one by one
+        data = self.get()
+        self.assertEqual(data['spotteds'], {'approved': 2, 'rejected': 0, 'deleted': 1, 'pending': 1, 'total': 4})
+        self.assertNotIn('prediction_cache', data)
+
+        count_spotteds(Rejected.objects.all())
+        Rejected.objects.get(message='spam').delete()
+        self.assertEqual(self.get()['spotteds']['rejected'], 1)
+
+    def test_since_and_breakdown(self):
+        today = timezone.localdate()
+        self.assertEqual(self.get(since=str(today))['spotteds']['total'], 4)
+        self.assertEqual(self.get(since=str(today + timedelta(days=1)))['spotteds']['total'], 0)
+
+        for since in ('2020-13-01', 'ontem'):
+            with self.subTest(since):
+                response = self.client.get(reverse('api:harumi'), {'since': since})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('since', response.data)
+
+        breakdown = self.get(breakdown='origin,reason,password')['breakdown']
+        self.assertEqual(set(breakdown), {'origin', 'reason'})
+        self.assertEqual(breakdown['origin']['approved'], {'outra': 1, 'spottedunicamp': 1})
+        self.assertEqual(breakdown['reason']['deleted'], {'Me arrependi': 1})
+
+
+class KeysetPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        Approved.objects.bulk_create([Approved(message=f'spotted {i}') for i in range(7)])
+        # Ties on created are broken by id
+        Approved.objects.filter(id__in=list(Approved.objects.order_by('id').values_list('id', flat=True)[2:5])).update(created=timezone.now())
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.url = reverse('api:list_approved')
+
+    def test_next_cursors_walk_every_row_once(self):
+        response = self.client.get(self.url, {'limit': 3})
+        self.assertEqual(response.data['count'], 7)
+        ids = [row['info']['id'] for row in response.data['results']]
+        pages = 1
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            self.assertEqual(response.status_code, 200)
+            ids += [row['info']['id'] for row in response.data['results']]
+            pages += 1
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(ids, list(Approved.objects.order_by('-created', '-id').values_list('id', flat=True)))
+
+    def test_previous_cursors_walk_back_the_same_pages(self):
+        pages = [self.client.get(self.url, {'limit': 3}).data]
+        self.assertIsNone(pages[0]['previous'])
+        while pages[-1]['next']:
+            pages.append(self.client.get(pages[-1]['next']).data)
+
+        response = pages[-1]
+        for page in reversed(pages[:-1]):
+            response = self.client.get(response['previous']).data
+            self.assertEqual(response['results'], page['results'])
+            self.assertEqual(response['previous'], page['previous'])
+        self.assertIsNone(response['previous'])
+        self.assertEqual(self.client.get(response['next']).data['results'], pages[1]['results'])
+
+    def test_count_can_be_skipped(self):
+        response = self.client.get(self.url, {'count': 'false'})
+        self.assertNotIn('count', response.data)
+        self.assertEqual(len(response.data['results']), 7)
+        self.assertIsNone(response.data['next'])
+
+    def test_invalid_cursors_are_not_found(self):
+        for cursor in ('abc', 'W10=', 'WyJvbnRlbSIsIDFd', 'WyIyMDE4LTAxLTAxVDAwOjAwOjAwIiwgMSwgMl0='):
+            with self.subTest(cursor):
+                self.assertEqual(self.client.get(self.url, {'cursor': cursor}).status_code, 404)
+
+    def test_offset_and_ordering_use_limit_offset_pages(self):
+        response = self.client.get(self.url, {'offset': 2, 'limit': 2})
+        self.assertEqual(response.data['count'], 7)
+        self.assertIn('previous', response.data)
+
+        response = self.client.get(self.url, {'ordering': 'id', 'limit': 2})
+        self.assertEqual([row['info']['id'] for row in response.data['results']], list(Approved.objects.order_by('id').values_list('id', flat=True)[:2]))
+
+
+class DatasetExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        Rejected.objects.bulk_create([Rejected(message=f'spam {i}', reason='Spam') for i in range(3)])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_streams_the_rows_as_an_attachment(self):
+        response = self.client.get(reverse('api:export', args=['rejected']), {'output': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="rejected.csv"')
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 4)
+
+    def test_rejects_unknown_outputs_and_dates(self):
+        url = reverse('api:export', args=['rejected'])
+        self.assertEqual(self.client.get(url, {'output': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'since': '2018-13-01'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'until': 'ontem'}).status_code, 400)
+
+
+class ChatViewQueryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        for i in range(5):
+            chat = Chat.objects.create(conversation_id=f'conversation-{i}', origin='page')
+            for j in range(4):
+                chat.append_message(f'mensagem {j}', 'user' if j % 2 == 0 else 'page')
+        cls.chat = chat
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_list_queries_do_not_grow_with_chats_or_messages(self):
+        # The count, the page of chats and the messages of the whole page
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('api:chat-list'))
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(sum(len(chat['message_log']) for chat in response.data['results']), 20)
+
+        with self.assertNumQueries(2):
+            self.client.get(reverse('api:chat-list'), {'count': 'false'})
+
+    def test_detail_queries_do_not_grow_with_messages(self):
+        # The chat and its messages
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('api:chat-detail', args=[self.chat.id]))
+        self.assertEqual(response.data['full_log'], [f'mensagem {j}' for j in range(4)])
+        self.assertEqual(len(response.data['message_log']), 4)
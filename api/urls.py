@@ -30,6 +30,7 @@ message_detail = views.MessageViewset.as_view({
 
 urlpatterns = [
     url(r'process_new_post/$', views.ProcessNewSpotted.as_view(), name='process_new_post'),
+    url(r'process_new_posts_batch/$', views.ProcessNewSpottedBatch.as_view(), name='process_new_posts_batch'),
     url(r'process_approved/$', views.ApprovedSpotted.as_view(), name='process_approved'),
     url(r'process_rejected/$', views.RejectedSpotted.as_view(), name='process_rejected'),
     url(r'process_deleted/$', views.DeletedSpotted.as_view(), name='process_deleted'),
@@ -39,13 +40,16 @@ urlpatterns = [
 
     url(r'list_approved/$', views.ApprovedList.as_view(), name='list_approved'),
     url(r'list_rejected/$', views.RejectedList.as_view(), name='list_rejected'),
+    url(r'export/(?P<kind>approved|rejected|deleted)/$', views.DatasetExport.as_view(), name='export'),
 
     url(r'harumi/$', views.HarumiEndpoint.as_view(), name='harumi'),
 
     url(r'chatbot/process_chat_message/$', views.ProcessChatMessage.as_view(), name='process_chat_message'),
     url(r'chatbot/chat_submit/$', views.ChatSubmit.as_view(), name='chat_submit'),
+    url(r'chatbot/chat_submit_batch/$', views.ChatSubmitBatch.as_view(), name='chat_submit_batch'),
     url(r'chatbot/chats/$', views.ChatListView.as_view(), name='chat-list'),
     url(r'chatbot/chats/(?P<pk>[0-9]+)/$', views.ChatDetailView.as_view(), name='chat-detail'),
+    url(r'chatbot/chats/(?P<pk>[0-9]+)/transcript/$', views.ChatTranscript.as_view(), name='chat-transcript'),
     url(r'chatbot/messages/$', message_list, name='message-list'),
     url(r'chatbot/messages/(?P<pk>[0-9]+)/$', message_detail, name='message-detail'),
 
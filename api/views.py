@@ -3,56 +3,228 @@ from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.views import APIView
 from rest_framework import viewsets
 from rest_framework.response import Response
-from datasets.serializers import ApprovedSerializer, RejectedSerializer
-from chatbot.serializers import ChatSubmitSerializer, ChatDetailSerializer, ChatListSerializer, MessageSerializer, ProcessMessageSerializer
+from datasets.serializers import ApprovedSerializer, RejectedSerializer, ValuesSerializer
+from chatbot.serializers import ChatBatchSerializer, ChatSubmitSerializer, ChatDetailSerializer, ChatListSerializer, MessageSerializer, ProcessMessageSerializer
 from rest_framework.authentication import SessionAuthentication, BasicAuthentication, TokenAuthentication
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.throttling import ScopedRateThrottle
-from datasets.models import Approved, Pending, Rejected, Deleted
+from datasets.models import Approved, Pending, Rejected, Deleted, SpottedCounter
+from datasets.writer import create_spotteds, defer, flush
+from datasets.export import OUTPUTS, export, parquet_available
 from chatbot.models import Chat, Message
+from chatbot.engine import process_message
 from rest_framework import generics
 from rest_framework import filters
 from rest_condition import Or
 from .roles import IsSpottedPage, IsHarumi
+from .filters import FullTextSearchFilter
+from .pagination import KeysetPagination, OldestFirstKeysetPagination
 from rest_framework.reverse import reverse
 from rest_framework import status
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch, Sum
+from django.utils.dateparse import parse_date
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
 import requests
+import json
 
-from processing.learning import spotted_analysis
+from processing.learning import spotted_analysis_batch
+from processing.duplicates import find_duplicate
+from processing.helpers import normalize_reason
 # Create your views here.
 
 
-class ApprovedList(generics.ListAPIView):
+class ValuesListMixin(object):
+    """Lists .values() rows through a ValuesSerializer of serializer_class,
+    giving the same JSON without a model instance and serializer per row."""
+
+    def list(self, request, *args, **kwargs):
+        serializer = ValuesSerializer(self.get_serializer_class())
+        queryset = self.filter_queryset(self.get_queryset()).values(*serializer.values)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.to_representation(page))
+        return Response(serializer.to_representation(queryset))
+
+
+class ApprovedList(ValuesListMixin, generics.ListAPIView):
     """Lista de Spotteds aprovados pela moderação e pela API."""
 
     authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
     permission_classes = (IsAdminUser,)
     queryset = Approved.objects.all()
     serializer_class = ApprovedSerializer
-    filter_backends = (filters.SearchFilter, DjangoFilterBackend, filters.OrderingFilter)
+    filter_backends = (FullTextSearchFilter, DjangoFilterBackend, filters.OrderingFilter)
     throttle_classes = (ScopedRateThrottle,)
     throttle_scope = 'list'
+    pagination_class = KeysetPagination
     filter_fields = ('id', 'by_api')
     search_fields = ('message', 'suggestion')
     ordering_fields = ('message', 'by_api', 'id', 'created', 'suggestion')
 
 
-class RejectedList(generics.ListAPIView):
+class RejectedList(ValuesListMixin, generics.ListAPIView):
     """Lista de Spotteds rejeitados pela moderação e pela API."""
 
     authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
     permission_classes = (IsAdminUser,)
     queryset = Rejected.objects.all()
     serializer_class = RejectedSerializer
-    filter_backends = (filters.SearchFilter, DjangoFilterBackend, filters.OrderingFilter)
+    filter_backends = (FullTextSearchFilter, DjangoFilterBackend, filters.OrderingFilter)
     throttle_classes = (ScopedRateThrottle,)
     throttle_scope = 'list'
+    pagination_class = KeysetPagination
     filter_fields = ('id', 'by_api')
     search_fields = ('message', 'suggestion', 'reason')
     ordering_fields = ('message', 'by_api', 'id', 'created', 'suggestion', 'reason')
 
 
+class DatasetExport(APIView):
+    """Exporta todos os Spotteds de um tipo, para treino e pesquisa.
+
+    `output` is `ndjson` (default), `csv` or `parquet`, `origin` filters by
+    origin and `since`/`until` (YYYY-MM-DD) by creation day. Rows are
+    streamed from a server-side cursor, so any table size takes the same memory.
+    """
+
+    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    permission_classes = (IsAdminUser,)
+    throttle_classes = (ScopedRateThrottle,)
+    throttle_scope = 'export'
+
+    def get(self, request, kind):
+        output = request.query_params.get('output', 'ndjson')
+        if output not in OUTPUTS:
+            raise ValidationError({'output': f"Choose one of {', '.join(OUTPUTS)}"})
+        if output == 'parquet' and not parquet_available():
+            raise ValidationError({'output': "Parquet needs pyarrow, which is not installed"})
+
+        dates = {}
+        for param in ('since', 'until'):
+            value = request.query_params.get(param)
+            try:
+                dates[param] = parse_date(value) if value else None
+            except ValueError:
+                dates[param] = None
+            if value and dates[param] is None:
+                raise ValidationError({param: "Use the YYYY-MM-DD format"})
+
+        content_type, extension = OUTPUTS[output]
+        response = StreamingHttpResponse(export(kind, output, request.query_params.get('origin'), **dates), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{kind}.{extension}"'
+        return response
+
+
+def spotted_content(data, user):
+    """Reads a new spotted from the request data."""
+    if not isinstance(data, dict):
+        raise ValidationError(["Must be an object with message and is_safe"])
+    missing = [field for field in ('message', 'is_safe') if field not in data]
+    if missing:
+        raise ValidationError({field: ["This field is required."] for field in missing})
+    if not isinstance(data['message'], str):
+        raise ValidationError({'message': ["Must be a string"]})
+
+    content = {
+        'message': data['message'],
+        'is_safe': data['is_safe'],
+        'has_attachment': data.get('has_attachment', False),
+        'user': user,
+    }
+
+    for field in ('is_safe', 'has_attachment'):
+        content[field] = parse_bool(field, content[field])
+
+    return content
+
+
+def parse_bool(field, value):
+    """Reads a boolean sent as a bool or as 'true'/'false', in any case."""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    raise ValidationError({field: ["Must be true or false"]})
+
+
+def analyse_spotteds(messages):
+    """Analyses new spotteds, flagging near-duplicates before classifying the rest.
+
+    Returns (publish, suggestion, percentage, duplicate) for each message,
+    where duplicate is (model, id, similarity) of an earlier spotted or None.
+    Duplicates are not classified, so their percentage is None.
+    """
+    duplicates = [find_duplicate(message) for message in messages]
+    analysis = iter(spotted_analysis_batch([m for m, d in zip(messages, duplicates) if d is None]))
+
+    results = []
+    for duplicate in duplicates:
+        if duplicate is None:
+            results.append(next(analysis) + (None,))
+        else:
+            results.append((False, 'Repetido', None, duplicate))
+    return results
+
+
+def spotted_action(publish, percentage, has_attachment, duplicate=None):
+    """Decides what to do with an analysed spotted."""
+    # Let the moderators confirm reposts
+    if duplicate is not None:
+        return 'moderation'
+
+    if publish and percentage > 0.70:
+        action = "approve"
+    elif not publish and percentage < 0.3:
+        action = "reject"
+    else:
+        action = "moderation"
+
+    # Send spotteds that contain attachments to moderation
+    if has_attachment and action == 'approve':
+        action = 'moderation'
+
+    return action
+
+
+def get_spotted_or_404(model, api_id):
+    """Gets a spotted, writing the deferred ones first if it was not found."""
+    try:
+        return model.objects.get(id=api_id)
+    except (model.DoesNotExist, ValueError):
+        flush()
+    return get_object_or_404(model, id=api_id)
+
+
+def spotted_response(publish, suggestion, percentage, duplicate, action, nid):
+    """Builds the answer to the page for an analysed spotted."""
+    return {
+        'confidence': percentage,
+        'action': action,
+        'api_id': nid,
+        # Reposts go to moderation, so they are not suggested for rejection
+        'suggestion': ("Rejeitar - " + suggestion) if not publish and duplicate is None else suggestion,
+        'duplicate_of': {
+            'type': duplicate[0].__name__.lower(),
+            'api_id': duplicate[1],
+            'similarity': duplicate[2],
+        } if duplicate is not None else None,
+    }
+
+
+def spotted_instance(content, action, suggestion):
+    """Builds the unsaved model instance for an analysed spotted."""
+    if action == "approve":
+        return Approved(message=content['message'], is_safe=content['is_safe'], suggestion=suggestion, origin=content['user'].username, by_api=True)
+    elif action == "reject":
+        return Rejected(message=content['message'], is_safe=content['is_safe'], suggestion=suggestion, origin=content['user'].username, by_api=True, reason=suggestion)
+    elif action == "moderation":
+        return Pending(message=content['message'], is_safe=content['is_safe'], suggestion=suggestion, origin=content['user'].username)
+    return None
+
+
 class ProcessNewSpotted(APIView):
     authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
     permission_classes = [Or(IsAdminUser, IsSpottedPage), ]
@@ -60,66 +232,78 @@ class ProcessNewSpotted(APIView):
     throttle_scope = 'new_spotted'
 
     def post(self, request):
-        content = {
-            'message': request.data['message'],
-            'is_safe': request.data['is_safe'],
-            'has_attachment': request.data.get('has_attachment', False),
-            'user': request.user,
-        }
+        content = spotted_content(request.data, request.user)
 
-        if isinstance(content['is_safe'], str):
-            content['is_safe'] = eval(content['is_safe'])
-        if isinstance(content['has_attachment'], str):
-            content['has_attachment'] = eval(content['has_attachment'])
-
-        if content['user'].username != 'localhost':
-            publish, suggestion, percentage = spotted_analysis(content['message'])
-            reason = suggestion
-            if publish and percentage > 0.70:
-                action = "approve"
-            elif not publish and percentage < 0.3:
-                action = "reject"
-            else:
-                action = "moderation"
-        else:
-            publish, suggestion, percentage = spotted_analysis(content['message'])
-            reason = suggestion
-            if publish and percentage > 0.70:
-                action = "approve"
-            elif not publish and percentage < 0.3:
-                action = "reject"
-            else:
-                action = "moderation"
-
-        # Send spotteds that contain attachments to moderation
-        if content['has_attachment'] and action == 'approve':
-            action = 'moderation'
-
-        if action == "approve":
-            n = Approved(message=content['message'], is_safe=content['is_safe'], suggestion=suggestion, origin=content['user'].username, by_api=True)
-        elif action == "reject":
-            n = Rejected(message=content['message'], is_safe=content['is_safe'], suggestion=suggestion, origin=content['user'].username, by_api=True, reason=reason)
-        elif action == "moderation":
-            n = Pending(message=content['message'], is_safe=content['is_safe'], suggestion=suggestion, origin=content['user'].username)
-        else:
-            n = None
+        publish, suggestion, percentage, duplicate = analyse_spotteds([content['message']])[0]
+        action = spotted_action(publish, percentage, content['has_attachment'], duplicate)
+        n = spotted_instance(content, action, suggestion)
 
         if not content['user'].username == 'localhost':
-            n.save()
+            if not defer([n]):
+                n.save()
             nid = n.id
 
         else:
             nid = -1
 
-        response = {
-            'confidence': percentage,
-            'action': action,
-            'api_id': nid,
-            'suggestion': ("Rejeitar - " + suggestion) if not publish else suggestion
-        }
+        response = spotted_response(publish, suggestion, percentage, duplicate, action, nid)
         return Response(response)
 
 
+class ProcessNewSpottedBatch(APIView):
+    """Processes a list of new spotteds at once.
+
+    Receives `messages`, a list of objects shaped like the data sent to
+    `process_new_post/`, and answers with one result per message, in order.
+    """
+
+    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    permission_classes = [Or(IsAdminUser, IsSpottedPage), ]
+    throttle_classes = (ScopedRateThrottle,)
+    throttle_scope = 'new_spotted_batch'
+
+    max_messages = 1000
+
+    def post(self, request):
+        messages = request.data.get('messages')
+        if isinstance(messages, str):
+            try:
+                messages = json.loads(messages)
+            except ValueError:
+                raise ValidationError({'messages': ["Invalid JSON"]})
+        if not isinstance(messages, list) or not messages:
+            raise ValidationError({'messages': ["Send a list with at least one spotted"]})
+        if len(messages) > self.max_messages:
+            raise ValidationError({'messages': [f"Send at most {self.max_messages} spotteds at once"]})
+
+        contents = []
+        for index, data in enumerate(messages):
+            try:
+                contents.append(spotted_content(data, request.user))
+            except ValidationError as error:
+                raise ValidationError({'messages': {index: error.detail}})
+        analysis = analyse_spotteds([content['message'] for content in contents])
+
+        instances = []
+        actions = []
+        for content, (publish, suggestion, percentage, duplicate) in zip(contents, analysis):
+            action = spotted_action(publish, percentage, content['has_attachment'], duplicate)
+            actions.append(action)
+            instances.append(spotted_instance(content, action, suggestion))
+
+        if not request.user.username == 'localhost':
+            if not defer(instances):
+                create_spotteds(instances)
+            nids = [n.id for n in instances]
+        else:
+            nids = [-1] * len(instances)
+
+        results = []
+        for result, action, nid in zip(analysis, actions, nids):
+            results.append(spotted_response(*result, action, nid))
+        return Response({'results': results})
+
+
 class ApprovedSpotted(APIView):
     authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
     permission_classes = [Or(IsAdminUser, IsSpottedPage), ]
@@ -133,12 +317,14 @@ class ApprovedSpotted(APIView):
         }
 
         if not content['user'].username == 'localhost':
-            instance = get_object_or_404(Pending, id=content['api_id'])
+            instance = get_spotted_or_404(Pending, content['api_id'])
 
-            n = Approved(message=instance.message, is_safe=instance.is_safe, suggestion=instance.suggestion, origin=content['user'].username)
-            n.save()
+            # The spotted and its counters move in one transaction
+            with transaction.atomic():
+                n = Approved(message=instance.message, is_safe=instance.is_safe, suggestion=instance.suggestion, origin=content['user'].username)
+                n.save()
+                instance.delete()
             nid = n.id
-            instance.delete()
         else:
             nid = -1
 
@@ -161,12 +347,14 @@ class RejectedSpotted(APIView):
             'user': request.user,
         }
         if not content['user'].username == 'localhost':
-            instance = get_object_or_404(Pending, id=content['api_id'])
+            instance = get_spotted_or_404(Pending, content['api_id'])
 
-            n = Rejected(message=instance.message, is_safe=instance.is_safe, suggestion=instance.suggestion, reason=content['reason'], origin=content['user'].username)
-            n.save()
+            # The spotted and its counters move in one transaction
+            with transaction.atomic():
+                n = Rejected(message=instance.message, is_safe=instance.is_safe, suggestion=instance.suggestion, reason=normalize_reason(content['reason']), origin=content['user'].username)
+                n.save()
+                instance.delete()
             nid = n.id
-            instance.delete()
 
         else:
             nid = -1
@@ -192,12 +380,14 @@ class DeletedSpotted(APIView):
         }
 
         if not content['user'].username == 'localhost':
-            instance = get_object_or_404(Approved, id=content['api_id'])
+            instance = get_spotted_or_404(Approved, content['api_id'])
 
-            n = Deleted(message=instance.message, is_safe=instance.is_safe, suggestion=instance.suggestion, by_api=instance.by_api, reason=content['reason'], by=content['by'], origin=content['user'].username)
-            n.save()
+            # The spotted and its counters move in one transaction
+            with transaction.atomic():
+                n = Deleted(message=instance.message, is_safe=instance.is_safe, suggestion=instance.suggestion, by_api=instance.by_api, reason=content['reason'], by=content['by'], origin=content['user'].username)
+                n.save()
+                instance.delete()
             nid = n.id
-            instance.delete()
 
         else:
             nid = -1
@@ -264,6 +454,9 @@ class ForMeDeleteOptions(APIView):
 
 # Harumi's View
 
+COUNTER_BREAKDOWNS = ('origin', 'by_api', 'reason', 'day')
+
+
 class HarumiEndpoint(APIView):
     """Se precisar de mais coisa é só avisar."""
 
@@ -272,10 +465,23 @@ class HarumiEndpoint(APIView):
 
     def get(self, request):
 
-        approved = len(Approved.objects.all())
-        rejected = len(Rejected.objects.all())
-        deleted = len(Deleted.objects.all())
-        pending = len(Pending.objects.all())
+        counters = SpottedCounter.objects.all()
+        # ?since=YYYY-MM-DD only counts the spotteds created from that day on
+        value = request.query_params.get('since')
+        if value:
+            try:
+                since = parse_date(value)
+            except ValueError:
+                since = None
+            if since is None:
+                raise ValidationError({'since': "Use the YYYY-MM-DD format"})
+            counters = counters.filter(day__gte=since)
+
+        totals = dict(counters.values_list('state').annotate(total=Sum('count')).order_by())
+        approved = totals.get('approved', 0)
+        rejected = totals.get('rejected', 0)
+        deleted = totals.get('deleted', 0)
+        pending = totals.get('pending', 0)
 
         response = {
             'endpoints': {
@@ -289,9 +495,19 @@ class HarumiEndpoint(APIView):
                 'deleted': deleted,
                 'pending': pending,
                 'total': approved + rejected + deleted + pending
-            }
+            },
         }
 
+        # ?breakdown=origin,day adds the counts of each state by those fields
+        breakdown = [field for field in request.query_params.get('breakdown', '').split(',') if field in COUNTER_BREAKDOWNS]
+        if breakdown:
+            response['breakdown'] = {}
+            for field in breakdown:
+                counts = {}
+                for state, value, total in counters.values_list('state', field).annotate(total=Sum('count')).order_by(field):
+                    counts.setdefault(state, {})[str(value)] = total
+                response['breakdown'][field] = counts
+
         return Response(response)
 
 
@@ -307,15 +523,14 @@ class ProcessChatMessage(generics.GenericAPIView):
         serializer.is_valid(True)
         message = serializer.data['message']
 
-        # Processa mensagem
-        # Mágica
-        # Fim do processamento
-        result = message
-        result_status = False
+        reply, result_status, confidence, latency = process_message(message)
 
         response = {
-            'result': result,
-            'result_status': result_status
+            # Without a confident reply the message is echoed back, as before
+            'result': reply if result_status else message,
+            'result_status': result_status,
+            'confidence': confidence,
+            'latency_ms': latency,
         }
         return Response(response)
 
@@ -350,25 +565,62 @@ class ChatSubmit(generics.CreateAPIView):
         return {}
 
 
+class ChatSubmitBatch(generics.GenericAPIView):
+    """Chat Submit Batch.
+
+    Receives `events`, a list of `conversation_id`, `sender` and `text`, and
+    appends them in order, creating the chats that are new.
+    """
+
+    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    permission_classes = (IsAuthenticated,)
+    serializer_class = ChatBatchSerializer
+    throttle_classes = (ScopedRateThrottle,)
+    throttle_scope = 'chatsubmit_batch'
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(origin=request.user.username)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
 class ChatListView(generics.ListAPIView):
-    queryset = Chat.objects.all()
+    # One query for the messages of the whole page, which only links to them,
+    # and no transcripts, which are only served by ChatTranscript
+    queryset = Chat.objects.defer('transcript').prefetch_related(Prefetch('message_log', queryset=Message.objects.order_by('sequence').only('id', 'chat')))
     authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
     permission_classes = (IsAdminUser,)
     serializer_class = ChatListSerializer
+    pagination_class = KeysetPagination
 
 
 class ChatDetailView(generics.RetrieveDestroyAPIView):
-    queryset = Chat.objects.all()
+    queryset = Chat.objects.defer('transcript').prefetch_related(Prefetch('message_log', queryset=Message.objects.order_by('sequence')))
     authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
     permission_classes = (IsAdminUser,)
     serializer_class = ChatDetailSerializer
 
 
+class ChatTranscript(APIView):
+    """Transcript of a chat as plain text, streamed from its messages."""
+
+    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request, pk):
+        chat = get_object_or_404(Chat.objects.defer('transcript'), pk=pk)
+        response = StreamingHttpResponse(chat.transcript_chunks(), content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="chat_{chat.conversation_id}.txt"'
+        return response
+
+
 class MessageViewset(viewsets.ReadOnlyModelViewSet):
     queryset = Message.objects.all()
     authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
     permission_classes = (IsAdminUser,)
     serializer_class = MessageSerializer
+    pagination_class = OldestFirstKeysetPagination
 
 
 class CoinhiveStats(APIView):
@@ -3,5 +3,16 @@ from .models import Chat, Message
 # Register your models here.
 
 
-admin.site.register(Chat)
-admin.site.register(Message)
+class MessageAdmin(admin.ModelAdmin):
+    list_select_related = ('chat',)
+
+
+class ChatAdmin(admin.ModelAdmin):
+
+    def get_queryset(self, request):
+        # The transcript is not editable, so the admin never shows it
+        return super().get_queryset(request).defer('transcript')
+
+
+admin.site.register(Chat, ChatAdmin)
+admin.site.register(Message, MessageAdmin)
@@ -0,0 +1,122 @@
+import os
+import pickle
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from .models import Message
+
+
+def conversation_pairs(chunk_size=2000):
+    """Conversation Pairs
+    yields (user message, page reply) pairs from the stored chats
+
+    consecutive user messages are joined into the one the page replied to
+    """
+    rows = Message.objects.order_by('chat', 'sequence').values_list('chat', 'sender', 'text')
+    chat, asked = None, []
+    for chat_id, sender, text in rows.iterator(chunk_size=chunk_size):
+        if chat_id != chat:
+            chat, asked = chat_id, []
+        if sender == 'user':
+            asked.append(text)
+        elif asked:
+            yield ' '.join(asked), text
+            asked = []
+
+
+class ChatEngine(object):
+    """Chat Engine
+    answers a message with the reply the page gave to the most similar
+    message in the past
+
+    past messages are kept as a matrix of l2 normalized TF-IDF rows, so the
+    similarity to all of them is one sparse product
+    """
+
+    def __init__(self):
+        self.vectorizer = None
+        self.matrix = None
+        self.replies = []
+
+    def __len__(self):
+        return len(self.replies)
+
+    def fit(self, pairs):
+        """Fit
+        indexes (message, reply) pairs
+
+        without any word to index the engine stays empty and knows no reply
+        """
+        pairs = list(pairs)
+        if pairs:
+            questions, replies = [list(p) for p in zip(*pairs)]
+            vectorizer = TfidfVectorizer(strip_accents='unicode', ngram_range=(1, 2), sublinear_tf=True)
+            try:
+                self.matrix = vectorizer.fit_transform(questions).tocsr()
+            except ValueError:
+                # Empty vocabulary
+                return self
+            self.vectorizer, self.replies = vectorizer, replies
+        return self
+
+    def reply(self, message):
+        """Reply
+        returns (reply, similarity) for the most similar past message, or
+        (None, 0.0) if nothing is known
+        """
+        if not self.replies:
+            return None, 0.0
+        scores = self.matrix.dot(self.vectorizer.transform([message]).T).toarray().ravel()
+        best = int(np.argmax(scores))
+        return self.replies[best], float(scores[best])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(self, f)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+
+_engine = None
+_engine_mtime = None
+_engine_lock = threading.Lock()
+
+
+def get_chat_engine():
+    """Get Chat Engine
+    returns the process wide chat engine
+
+    it is loaded from CHAT_ENGINE_PATH, and again whenever rebuild_chat_engine
+    saves a new one there. Until then the engine is empty, so messages are
+    echoed, and it is never fitted while answering a request
+    """
+    global _engine, _engine_mtime
+    path = settings.CHAT_ENGINE_PATH
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    if _engine is None or mtime != _engine_mtime:
+        with _engine_lock:
+            if _engine is None or mtime != _engine_mtime:
+                _engine = ChatEngine.load(path) if mtime is not None else ChatEngine()
+                _engine_mtime = mtime
+    return _engine
+
+
+def process_message(message):
+    """Process Message
+    returns (reply, confident, similarity, latency in ms) for a user message
+
+    replies less similar than CHAT_ENGINE_THRESHOLD are not confident
+    """
+    start = time.perf_counter()
+    reply, similarity = get_chat_engine().reply(message)
+    latency = (time.perf_counter() - start) * 1000
+    return reply, reply is not None and similarity >= settings.CHAT_ENGINE_THRESHOLD, similarity, latency
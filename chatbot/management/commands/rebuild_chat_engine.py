@@ -0,0 +1,21 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from chatbot.engine import ChatEngine, conversation_pairs
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the chatbot reply engine from the stored chats and saves it for the workers to load'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=None, help='Where to save the engine, CHAT_ENGINE_PATH by default')
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.CHAT_ENGINE_PATH
+
+        start = time.perf_counter()
+        engine = ChatEngine().fit(conversation_pairs())
+        engine.save(path)
+
+        self.stdout.write(f"Indexed {len(engine)} replies in {time.perf_counter() - start:.2f}s, saved to {path}")
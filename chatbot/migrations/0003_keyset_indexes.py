@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.0.4 on 2018-06-11 16:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0002_auto_20180601_0115'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['created', 'id'], name='chat_created_id'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['created', 'id'], name='message_created_id'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.0.4 on 2018-06-12 11:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def number_messages(apps, schema_editor):
+    """Numbers the messages of each chat by creation, with one UPDATE for all of them."""
+    connection = schema_editor.connection
+    message = schema_editor.quote_name(apps.get_model('chatbot', 'Message')._meta.db_table)
+    chat = schema_editor.quote_name(apps.get_model('chatbot', 'Chat')._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                f"UPDATE {message} SET sequence = numbered.position FROM ("
+                f"SELECT id, ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY created, id) - 1 AS position FROM {message}"
+                f") AS numbered WHERE {message}.id = numbered.id"
+            )
+        else:
+            cursor.execute(
+                f"UPDATE {message} SET sequence = (SELECT COUNT(*) FROM {message} AS earlier "
+                f"WHERE earlier.chat_id = {message}.chat_id AND (earlier.created < {message}.created "
+                f"OR (earlier.created = {message}.created AND earlier.id < {message}.id)))"
+            )
+        cursor.execute(f"UPDATE {chat} SET message_count = (SELECT COUNT(*) FROM {message} WHERE {message}.chat_id = {chat}.id)")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0003_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='sequence',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(number_messages, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.0.4 on 2018-06-12 11:05
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0004_message_sequence'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='message',
+            options={'ordering': ['created', 'sequence']},
+        ),
+        migrations.AlterUniqueTogether(
+            name='message',
+            unique_together={('chat', 'sequence')},
+        ),
+    ]
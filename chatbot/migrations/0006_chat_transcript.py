@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.0.4 on 2018-06-12 15:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def render_transcripts(apps, schema_editor):
+    Chat = apps.get_model('chatbot', 'Chat')
+    Message = apps.get_model('chatbot', 'Message')
+    for chat in Chat.objects.all().iterator():
+        lines = [
+            f"{message.created.strftime('%d %b %H:%M')} {message.get_sender_display()} says:\n{message.text}\n"
+            for message in Message.objects.filter(chat=chat).order_by('sequence')
+        ]
+        Chat.objects.filter(id=chat.id).update(transcript=''.join(lines))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0005_message_sequence_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='transcript',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(render_transcripts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.0.4 on 2018-06-12 16:02
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0006_chat_transcript'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='message',
+            options={'ordering': ['chat', 'sequence']},
+        ),
+    ]
@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat
 from .validators import SenderChoicesValidator
 # Create your models here.
 
@@ -7,26 +9,58 @@ class Chat(models.Model):
     conversation_id = models.CharField(unique=True, max_length=32)
     created = models.DateTimeField(auto_now_add=True)
     origin = models.CharField(max_length=30)
+    message_count = models.PositiveIntegerField(default=0)
+    transcript = models.TextField(blank=True, default='', editable=False)  # Rendered messages, appended to by append_message
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created', 'id'], name='chat_created_id'),
+        ]
 
     def append_message(self, text, sender):
         SenderChoicesValidator()(sender)
-        Message.objects.create(
-            chat=self,
-            text=text,
-            sender=sender
-        )
+        with transaction.atomic():
+            # The update locks the chat, so concurrent messages get consecutive sequences
+            Chat.objects.filter(pk=self.pk).update(message_count=F('message_count') + 1)
+            self.message_count = Chat.objects.values_list('message_count', flat=True).get(pk=self.pk)
+            message = Message.objects.create(
+                chat=self,
+                text=text,
+                sender=sender,
+                sequence=self.message_count - 1
+            )
+            Chat.objects.filter(pk=self.pk).update(transcript=Concat('transcript', Value(message.display_text + '\n')))
+        # Deferred, so that the transcript is only read again if it is used
+        self.__dict__.pop('transcript', None)
+        return message
 
     def log_generator(self):
-        messages = self.message_log.all()
+        messages = self.message_log.order_by('sequence')
         for message in messages:
             yield message.display_text
 
+    @property
+    def header(self):
+        return f"{self.created.strftime('%d %b %H:%M')} Chat {self.conversation_id} ({self.origin}):\n"
+
+    def transcript_chunks(self, chunk_size=500):
+        """Transcript Chunks
+        renders the transcript from the messages, chunk_size messages at a time
+
+        for streaming long conversations without holding them in memory
+        """
+        yield self.header
+        chunk = []
+        for message in self.message_log.order_by('sequence').iterator(chunk_size=chunk_size):
+            chunk.append(message.display_text + '\n')
+            if len(chunk) == chunk_size:
+                yield ''.join(chunk)
+                chunk = []
+        if chunk:
+            yield ''.join(chunk)
+
     def get_full_log(self):
-        full_log = f"{self.created.strftime('%d %b %H:%M')} Chat {self.conversation_id} ({self.origin}):\n"
-        log = self.log_generator()
-        for message in log:
-            full_log += message + '\n'
-        return full_log
+        return self.header + self.transcript
 
     @property
     def full_log(self):
@@ -48,17 +82,22 @@ class Message(models.Model):
     text = models.TextField()
     sender = models.CharField(choices=sender_choices, max_length=10)
     created = models.DateTimeField(auto_now_add=True)
+    sequence = models.PositiveIntegerField(default=0)  # Position of the message in its chat, from 0
 
     @property
     def index(self):
-        return self.chat.message_log.filter(created__lt=self.created).count()
+        return self.sequence
 
     @property
     def display_text(self):
         return f"{self.created.strftime('%d %b %H:%M')} {self.get_sender_display()} says:\n{self.text}"
 
     class Meta:
-        ordering = ['created']
+        ordering = ['chat', 'sequence']
+        unique_together = ('chat', 'sequence')
+        indexes = [
+            models.Index(fields=['created', 'id'], name='message_created_id'),
+        ]
 
     def __str__(self):
         return f"Message {self.index} ({self.get_sender_display()}) from {str(self.chat)}"
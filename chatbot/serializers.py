@@ -1,3 +1,6 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Case, IntegerField, TextField, Value, When
+from django.db.models.functions import Concat
 from rest_framework import serializers
 from .models import Chat, Message
 
@@ -51,7 +54,7 @@ class ChatSubmitSerializer(serializers.ModelSerializer):
         origin = validated_data.get('origin')
         text = self.context['request'].data.get('text')
         sender = self.context['request'].data.get('sender')
-        instance, _ = self.Meta.model.objects.get_or_create(conversation_id=conv_id, origin=origin)
+        instance, _ = self.Meta.model.objects.defer('transcript').get_or_create(conversation_id=conv_id, origin=origin)
         instance.append_message(text, sender)
         return instance
 
@@ -62,3 +65,77 @@ class ChatSubmitSerializer(serializers.ModelSerializer):
 
         messageserializer = MessageSerializer(data=self.context['request'].data)
         messageserializer.is_valid(raise_exception=True)
+
+
+class ChatEventSerializer(serializers.Serializer):
+    conversation_id = serializers.CharField(max_length=32)
+    sender = serializers.ChoiceField(choices=Message.sender_choices)
+    text = serializers.CharField()
+
+
+class ChatBatchSerializer(serializers.Serializer):
+    """Chat Batch Serializer.
+
+    Appends many messages, possibly to many chats, in one transaction: one
+    query to lock the chats, one to create the missing ones, one to create
+    the messages and one to update the chats, whatever the number of events.
+    """
+
+    max_events = 1000
+
+    events = ChatEventSerializer(many=True)
+
+    def validate_events(self, events):
+        if not events:
+            raise serializers.ValidationError("Send at least one event")
+        if len(events) > self.max_events:
+            raise serializers.ValidationError(f"Send at most {self.max_events} events at once")
+        return events
+
+    def create(self, validated_data):
+        events = validated_data['events']
+        origin = validated_data['origin']
+        conversation_ids = list(dict.fromkeys(event['conversation_id'] for event in events))
+
+        with transaction.atomic():
+            chats = self.lock_chats(conversation_ids)
+            missing = [conversation_id for conversation_id in conversation_ids if conversation_id not in chats]
+            if missing:
+                try:
+                    with transaction.atomic():
+                        Chat.objects.bulk_create([Chat(conversation_id=conversation_id, origin=origin) for conversation_id in missing])
+                except IntegrityError:
+                    # Some were created meanwhile by another request
+                    for conversation_id in missing:
+                        Chat.objects.defer('transcript').get_or_create(conversation_id=conversation_id, defaults={'origin': origin})
+                chats = self.lock_chats(conversation_ids)
+
+            foreign = [chat.conversation_id for chat in chats.values() if chat.origin != origin]
+            if foreign:
+                raise serializers.ValidationError({'events': [f"Chats from another origin: {', '.join(foreign)}"]})
+
+            messages, lines = [], {}
+            for event in events:
+                chat = chats[event['conversation_id']]
+                messages.append(Message(chat=chat, text=event['text'], sender=event['sender'], sequence=chat.message_count))
+                chat.message_count += 1
+            Message.objects.bulk_create(messages)
+
+            for message in messages:
+                lines.setdefault(message.chat_id, []).append(message.display_text + '\n')
+            updated = [chat for chat in chats.values() if chat.id in lines]
+            Chat.objects.filter(id__in=[chat.id for chat in updated]).update(
+                message_count=Case(*[When(id=chat.id, then=Value(chat.message_count)) for chat in updated], output_field=IntegerField()),
+                transcript=Concat('transcript', Case(*[When(id=chat.id, then=Value(''.join(lines[chat.id]))) for chat in updated], output_field=TextField())),
+            )
+
+        return messages
+
+    def lock_chats(self, conversation_ids):
+        chats = Chat.objects.select_for_update().filter(conversation_id__in=conversation_ids).only('id', 'conversation_id', 'origin', 'message_count')
+        return {chat.conversation_id: chat for chat in chats}
+
+    def to_representation(self, messages):
+        return {
+            'messages': [{'conversation_id': message.chat.conversation_id, 'index': message.sequence} for message in messages],
+        }
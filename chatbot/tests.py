@@ -1,3 +1,252 @@
-from django.test import TestCase
+import importlib
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import engine
+from .engine import ChatEngine, conversation_pairs, process_message
+from .models import Chat, Message
+from .serializers import ChatBatchSerializer
+
+
+class MessageSequenceTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('page', 'page@example.com', 'pw'))
+
+    def test_messages_are_numbered_consecutively_in_their_chat(self):
+        for i in range(3):
+            for conversation_id in ('first', 'second'):
+                response = self.client.post(reverse('api:chat_submit'), {'conversation_id': conversation_id, 'text': f'mensagem {i}', 'sender': 'user'})
+                self.assertEqual(response.status_code, 201)
+
+        for chat in Chat.objects.all():
+            self.assertEqual(chat.origin, 'page')
+            self.assertEqual(chat.message_count, 3)
+            self.assertEqual(list(chat.message_log.order_by('sequence').values_list('sequence', 'text')), [(i, f'mensagem {i}') for i in range(3)])
+
+    def test_messages_are_ordered_by_sequence_within_their_chat(self):
+        chat = Chat.objects.create(conversation_id='conversation', origin='page')
+        messages = [chat.append_message(f'mensagem {i}', 'user') for i in range(3)]
+        # A clock that went back between messages
+        Message.objects.filter(id=messages[0].id).update(created=messages[2].created + timedelta(seconds=1))
+        self.assertEqual(list(chat.message_log.values_list('sequence', flat=True)), [0, 1, 2])
+
+    def test_existing_messages_are_numbered_by_creation(self):
+        number_messages = importlib.import_module('chatbot.migrations.0004_message_sequence').number_messages
+        chats = [Chat.objects.create(conversation_id=f'conversation-{i}', origin='page') for i in range(2)]
+        now = timezone.now()
+        for i, created in enumerate([3, 1, 2, 1]):
+            message = Message.objects.create(chat=chats[0], text=f'mensagem {i}', sender='user', sequence=100 + i)
+            Message.objects.filter(id=message.id).update(created=now + timedelta(seconds=created))
+        Message.objects.create(chat=chats[1], text='sozinha', sender='user', sequence=100)
+
+        number_messages(apps, connection.schema_editor())
+
+        self.assertEqual(list(chats[0].message_log.values_list('text', flat=True)), ['mensagem 1', 'mensagem 3', 'mensagem 2', 'mensagem 0'])
+        self.assertEqual(list(chats[1].message_log.values_list('sequence', flat=True)), [0])
+        self.assertEqual(sorted(Chat.objects.values_list('message_count', flat=True)), [1, 4])
+
+    def test_a_sequence_is_used_once_per_chat(self):
+        message = Chat.objects.create(conversation_id='conversation', origin='page').append_message('oi', 'user')
+        with self.assertRaises(IntegrityError):
+            Message.objects.create(chat=message.chat, text='de novo', sender='user', sequence=message.sequence)
+
+
+class ChatBatchTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('page', 'page@example.com', 'pw'))
+        self.url = reverse('api:chat_submit_batch')
+        Chat.objects.create(conversation_id='existing', origin='page').append_message('oi', 'user')
+
+    def post(self, events):
+        return self.client.post(self.url, {'events': events}, format='json')
+
+    def test_events_are_appended_in_order(self):
+        events = [
+            {'conversation_id': 'existing', 'sender': 'page', 'text': 'olá'},
+            {'conversation_id': 'new', 'sender': 'user', 'text': 'primeira'},
+            {'conversation_id': 'existing', 'sender': 'user', 'text': 'tudo bem?'},
+        ]
+        # Locking the chats, creating the new one and locking it, the messages
+        # and the chats, plus the savepoints of both transactions
+        with self.assertNumQueries(9):
+            response = self.post(events)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['messages'], [
+            {'conversation_id': 'existing', 'index': 1},
+            {'conversation_id': 'new', 'index': 0},
+            {'conversation_id': 'existing', 'index': 2},
+        ])
+
+        existing = Chat.objects.get(conversation_id='existing')
+        self.assertEqual(existing.message_count, 3)
+        self.assertEqual(list(existing.message_log.order_by('sequence').values_list('text', flat=True)), ['oi', 'olá', 'tudo bem?'])
+        self.assertEqual(existing.get_full_log(), ''.join(existing.transcript_chunks()))
+        self.assertEqual(Chat.objects.get(conversation_id='new').origin, 'page')
+
+    def test_chats_of_another_origin_are_refused(self):
+        Chat.objects.create(conversation_id='foreign', origin='outra')
+        response = self.post([
+            {'conversation_id': 'existing', 'sender': 'page', 'text': 'olá'},
+            {'conversation_id': 'foreign', 'sender': 'page', 'text': 'olá'},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_rejects_empty_and_oversized_batches(self):
+        self.assertEqual(self.post([]).status_code, 400)
+        events = [{'conversation_id': 'existing', 'sender': 'user', 'text': f'mensagem {i}'} for i in range(3)]
+        with mock.patch.object(ChatBatchSerializer, 'max_events', 2):
+            self.assertEqual(self.post(events).status_code, 400)
+        self.assertEqual(self.post([{'conversation_id': 'existing', 'sender': 'bot', 'text': 'oi'}]).status_code, 400)
+        self.assertEqual(Message.objects.count(), 1)
+
+
+class TranscriptTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        cls.chat = Chat.objects.create(conversation_id='conversation', origin='page')
+        for i in range(5):
+            cls.chat.append_message(f'mensagem {i}', 'user' if i % 2 == 0 else 'page')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def expected_log(self, chat):
+        return chat.header + ''.join(message.display_text + '\n' for message in chat.message_log.order_by('sequence'))
+
+    def test_full_log_matches_the_messages(self):
+        chat = Chat.objects.get(pk=self.chat.pk)
+        self.assertEqual(chat.get_full_log(), self.expected_log(chat))
+        self.assertEqual(''.join(chat.transcript_chunks(chunk_size=2)), chat.get_full_log())
+
+    def test_transcript_is_streamed(self):
+        response = self.client.get(reverse('api:chat-transcript', args=[self.chat.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="chat_conversation.txt"')
+        self.assertEqual(b''.join(response.streaming_content).decode('utf-8'), self.expected_log(Chat.objects.get(pk=self.chat.pk)))
+
+    def test_transcript_is_not_read_where_it_is_not_served(self):
+        urls = [
+            reverse('api:chat-list'),
+            reverse('api:chat-detail', args=[self.chat.pk]),
+            reverse('api:chat-transcript', args=[self.chat.pk]),
+        ]
+        for url in urls:
+            with self.subTest(url), CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            self.assertFalse([query['sql'] for query in queries if '"transcript"' in query['sql']])
+
+
+class ChatEngineTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        conversations = [
+            [('user', 'oi'), ('user', 'como envio um spotted?'), ('page', 'Pelo formulário do site'), ('page', 'obrigado')],
+            [('page', 'olá'), ('user', 'qual o horário do bandejão?'), ('page', 'Das 11h às 14h')],
+        ]
+        for i, messages in enumerate(conversations):
+            chat = Chat.objects.create(conversation_id=f'conversation-{i}', origin='page')
+            for sender, text in messages:
+                chat.append_message(text, sender)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'chat_engine.pkl')
+        engine._engine = engine._engine_mtime = None
+
+    def tearDown(self):
+        engine._engine = engine._engine_mtime = None
+        shutil.rmtree(self.directory)
+
+    def test_pairs_join_the_user_messages_a_reply_answers(self):
+        self.assertEqual(list(conversation_pairs(chunk_size=2)), [
+            ('oi como envio um spotted?', 'Pelo formulário do site'),
+            ('qual o horário do bandejão?', 'Das 11h às 14h'),
+        ])
+
+    def test_replies_with_the_most_similar_past_message(self):
+        chat_engine = ChatEngine().fit(conversation_pairs())
+        reply, similarity = chat_engine.reply('que horário abre o bandejão')
+        self.assertEqual(reply, 'Das 11h às 14h')
+        self.assertGreater(similarity, 0)
+        self.assertEqual(ChatEngine().fit([]).reply('oi'), (None, 0.0))
+
+    def rebuild(self):
+        call_command('rebuild_chat_engine', '--path', self.path, stdout=open(os.devnull, 'w'))
+
+    def test_empty_corpora_give_an_empty_engine(self):
+        chat_engine = ChatEngine().fit([('?!', 'resposta'), ('a', 'outra')])
+        self.assertEqual(len(chat_engine), 0)
+        self.assertEqual(chat_engine.reply('oi'), (None, 0.0))
+
+        Chat.objects.all().delete()
+        self.rebuild()
+        self.assertEqual(len(ChatEngine.load(self.path)), 0)
+
+    def test_only_similar_replies_are_confident(self):
+        self.rebuild()
+        with override_settings(CHAT_ENGINE_PATH=self.path, CHAT_ENGINE_THRESHOLD=0.3):
+            reply, confident, similarity, _ = process_message('qual o horário do bandejão?')
+            self.assertEqual(reply, 'Das 11h às 14h')
+            self.assertTrue(confident)
+
+            _, confident, similarity, _ = process_message('alguém viu meu guarda-chuva')
+            self.assertFalse(confident)
+            self.assertLess(similarity, 0.3)
+
+    def test_workers_load_the_rebuilt_engine(self):
+        with override_settings(CHAT_ENGINE_PATH=self.path):
+            # Never fitted by a worker, messages are echoed until it is rebuilt
+            with mock.patch.object(ChatEngine, 'fit', side_effect=AssertionError("fitted in a worker")):
+                self.assertEqual(len(engine.get_chat_engine()), 0)
+                self.assertIs(engine.get_chat_engine(), engine.get_chat_engine())
+                self.assertFalse(process_message('qual o horário do bandejão?')[1])
+
+            self.rebuild()
+            self.assertEqual(len(engine.get_chat_engine()), 2)
+
+            Chat.objects.get(conversation_id='conversation-1').append_message('e no sábado?', 'user')
+            Chat.objects.get(conversation_id='conversation-1').append_message('Fechado', 'page')
+            self.rebuild()
+            # A rebuild within the resolution of the file system clock
+            os.utime(self.path, ns=(1, 1))
+            self.assertEqual(len(engine.get_chat_engine()), 3)
+
+    def test_unconfident_messages_are_echoed(self):
+        self.rebuild()
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        with override_settings(CHAT_ENGINE_PATH=self.path):
+            response = client.post(reverse('api:process_chat_message'), {'message': 'alguém viu meu guarda-chuva'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['result'], 'alguém viu meu guarda-chuva')
+            self.assertFalse(response.data['result_status'])
+
+            response = client.post(reverse('api:process_chat_message'), {'message': 'qual o horário do bandejão?'})
+            self.assertEqual(response.data['result'], 'Das 11h às 14h')
+            self.assertTrue(response.data['result_status'])
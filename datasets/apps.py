@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class DatasetsConfig(AppConfig):
     name = 'datasets'
+
+    def ready(self):
+        from . import checks  # noqa: F401
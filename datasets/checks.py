@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.checks import Error, register
+from django.db import connections, router
+
+
+@register()
+def check_deferred_writes(app_configs, **kwargs):
+    """Deferred writes reserve the ids of new spotteds from PostgreSQL sequences."""
+    from .models import Pending
+
+    if settings.DEFERRED_WRITES and connections[router.db_for_write(Pending)].vendor != 'postgresql':
+        return [Error(
+            "DEFERRED_WRITES needs PostgreSQL",
+            hint="The ids of deferred spotteds are reserved from PostgreSQL sequences. Turn DEFERRED_WRITES off.",
+            id='datasets.E001',
+        )]
+    return []
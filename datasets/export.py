@@ -0,0 +1,148 @@
+import csv
+import io
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Approved, Rejected, Deleted
+
+
+EXPORTED = {
+    'approved': Approved,
+    'rejected': Rejected,
+    'deleted': Deleted,
+}
+
+OUTPUTS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'parquet': ('application/octet-stream', 'parquet'),
+}
+
+
+def parquet_available():
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def export_fields(model):
+    return [f.attname for f in model._meta.concrete_fields if f.name != 'search_vector']
+
+
+def export_rows(kind, origin=None, since=None, until=None, chunk_size=2000):
+    """Export Rows
+    returns the exported fields of a kind of spotted and an iterator over its rows
+
+    rows are read as tuples through a server-side cursor, chunk_size at a time
+
+    kind: 'approved', 'rejected' or 'deleted'
+    since, until: dates limiting when the spotteds were created, both inclusive
+    """
+    model = EXPORTED[kind]
+    fields = export_fields(model)
+
+    data = model.objects.order_by('id')
+    if origin:
+        data = data.filter(origin=origin)
+    if since:
+        data = data.filter(created__date__gte=since)
+    if until:
+        data = data.filter(created__date__lte=until)
+
+    return fields, data.values_list(*fields).iterator(chunk_size=chunk_size)
+
+
+def chunked(rows, chunk_size):
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def ndjson_lines(fields, rows, chunk_size=2000):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for chunk in chunked(rows, chunk_size):
+        yield ''.join(encoder.encode(dict(zip(fields, row))) + '\n' for row in chunk).encode('utf-8')
+
+
+def csv_lines(fields, rows, chunk_size=2000):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for chunk in chunked(rows, chunk_size):
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+class _Sink(object):
+    """Writable file handing what was written to the caller chunk by chunk."""
+
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data, self.parts = b''.join(self.parts), []
+        return data
+
+
+def parquet_chunks(fields, rows, model, chunk_size=2000):
+    """Parquet Chunks
+    writes one row group per chunk of rows, yielding the bytes of each as soon
+    as they are written
+
+    needs pyarrow
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {
+        'AutoField': pa.int64(),
+        'BooleanField': pa.bool_(),
+        'DateTimeField': pa.timestamp('us', tz='UTC'),
+    }
+    schema = pa.schema([
+        pa.field(name, types.get(model._meta.get_field(name).get_internal_type(), pa.string()))
+        for name in fields
+    ])
+
+    sink = _Sink()
+    writer = pq.ParquetWriter(sink, schema)
+    for chunk in chunked(rows, chunk_size):
+        columns = [pa.array(column, type=field.type) for column, field in zip(zip(*chunk), schema)]
+        writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def export(kind, output='ndjson', origin=None, since=None, until=None, chunk_size=2000):
+    """Export
+    streams spotteds of a kind as NDJSON, CSV or Parquet
+
+    returns an iterator of bytes, holding at most chunk_size rows in memory
+    """
+    fields, rows = export_rows(kind, origin, since, until, chunk_size)
+    if output == 'csv':
+        return csv_lines(fields, rows, chunk_size)
+    if output == 'parquet':
+        return parquet_chunks(fields, rows, EXPORTED[kind], chunk_size)
+    return ndjson_lines(fields, rows, chunk_size)
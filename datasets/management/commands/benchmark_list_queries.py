@@ -0,0 +1,70 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from datasets.models import Approved, Rejected
+
+
+ORIGIN = 'benchmark'
+ORIGINS = [ORIGIN, 'outra']
+WORDS = ['amor', 'gata', 'lindo', 'biblioteca', 'bandejao', 'ciclo', 'basico', 'crush', 'olhos', 'sorriso', 'aula', 'calculo']
+
+
+class Command(BaseCommand):
+    help = 'Times the list, filter and search queries of the API on synthetic spotteds, in a test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000, help='Synthetic rows inserted in each table')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--keepdb', action='store_true', help='Keep the test database between runs')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive', help='Replace an existing test database without asking')
+
+    def handle(self, *args, **options):
+        page = settings.REST_FRAMEWORK['PAGE_SIZE']
+        models = (Approved, Rejected)
+
+        # The rows go to a test database, like the one of manage.py test, so
+        # the live tables, their counters and the duplicate index never see them
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=not options['interactive'], serialize=False, keepdb=options['keepdb'])
+        try:
+            for model in models:
+                self.stdout.write(f"Inserting {options['rows']} {model.__name__} rows...")
+                self.insert(model, options['rows'], options['batch_size'])
+
+            self.stdout.write(f"{'query':<45} {'best (ms)':>10} {'median (ms)':>12}")
+            for model in models:
+                # The queries of the list views, of get_data and of the exports
+                spotteds = model.objects.all()
+                since = spotteds.order_by('created').values_list('created', flat=True)[options['rows'] // 2]
+                queries = [
+                    ('list, newest first', lambda: list(spotteds.order_by('-created', '-id')[:page])),
+                    ('list after a cursor', lambda: list(spotteds.filter(created__lt=since).order_by('-created', '-id')[:page])),
+                    ('filter by_api, newest first', lambda: list(spotteds.filter(by_api=True).order_by('-created')[:page])),
+                    ('count by_api since a date', lambda: spotteds.filter(by_api=True, created__gte=since).count()),
+                    ('dataset chunk by origin', lambda: list(spotteds.filter(origin=ORIGIN).order_by('created').values_list('message')[:2000])),
+                    ('count origin since a date', lambda: spotteds.filter(origin=ORIGIN, created__gte=since).count()),
+                    ('search message', lambda: list(spotteds.filter(message__icontains='bandejao')[:page])),
+                ]
+                for label, query in queries:
+                    timings = []
+                    for _ in range(options['repeat']):
+                        start = time.perf_counter()
+                        query()
+                        timings.append(time.perf_counter() - start)
+                    timings.sort()
+                    label = f"{model.__name__}: {label}"
+                    self.stdout.write(f"{label:<45} {timings[0] * 1000:>10.2f} {timings[len(timings) // 2] * 1000:>12.2f}")
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+    def insert(self, model, rows, batch_size):
+        extra = {'reason': 'Spam'} if model is Rejected else {}
+        for offset in range(0, rows, batch_size):
+            model.objects.bulk_create([
+                model(message=' '.join(random.choice(WORDS) for _ in range(12)), suggestion='', by_api=random.random() < 0.5, origin=random.choice(ORIGINS), **extra)
+                for _ in range(min(batch_size, rows - offset))
+            ])
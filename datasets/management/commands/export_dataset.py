@@ -0,0 +1,32 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from datasets.export import EXPORTED, OUTPUTS, export, parquet_available
+
+
+class Command(BaseCommand):
+    help = 'Streams every spotted of a kind to a file as NDJSON, CSV or Parquet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(EXPORTED))
+        parser.add_argument('--output', choices=list(OUTPUTS), default='ndjson')
+        parser.add_argument('--file', help='Where to write, standard output by default')
+        parser.add_argument('--origin')
+        parser.add_argument('--since', type=parse_date, help='First creation day, YYYY-MM-DD')
+        parser.add_argument('--until', type=parse_date, help='Last creation day, YYYY-MM-DD')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if options['output'] == 'parquet' and not parquet_available():
+            raise CommandError("Parquet needs pyarrow, which is not installed")
+
+        chunks = export(options['kind'], options['output'], options['origin'], options['since'], options['until'], options['chunk_size'])
+        if options['file']:
+            with open(options['file'], 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.0.4 on 2018-06-10 14:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def fill_counters(apps, schema_editor):
+    SpottedCounter = apps.get_model('datasets', 'SpottedCounter')
+    counted = (
+        ('approved', 'Approved', ('origin', 'by_api')),
+        ('rejected', 'Rejected', ('origin', 'by_api', 'reason')),
+        ('deleted', 'Deleted', ('origin', 'by_api', 'reason')),
+        ('pending', 'Pending', ('origin',)),
+    )
+    for state, model_name, fields in counted:
+        model = apps.get_model('datasets', model_name)
+        rows = model.objects.annotate(day=TruncDate('created')).values('day', *fields).annotate(count=Count('id')).order_by()
+        SpottedCounter.objects.bulk_create([SpottedCounter(state=state, **row) for row in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0007_auto_20180203_2124'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpottedCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(max_length=10)),
+                ('origin', models.CharField(max_length=30)),
+                ('by_api', models.BooleanField(default=False)),
+                ('reason', models.CharField(blank=True, default='', max_length=100)),
+                ('day', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='spottedcounter',
+            index=models.Index(fields=['day'], name='datasets_sp_day_99e9a8_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='spottedcounter',
+            unique_together={('state', 'origin', 'by_api', 'reason', 'day')},
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
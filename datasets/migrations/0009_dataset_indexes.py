@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.0.4 on 2018-06-10 15:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# Trigram indexes serve the icontains lookups of the list searches. SQLite
+# has no index for them and keeps scanning, which is fine at its sizes
+TRIGRAM_INDEXES = (
+    ('datasets_approved', 'approved_message_trgm'),
+    ('datasets_rejected', 'rejected_message_trgm'),
+)
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for table, name in TRIGRAM_INDEXES:
+        schema_editor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin (UPPER(message) gin_trgm_ops)")
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, name in TRIGRAM_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0008_spottedcounter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='approved',
+            index=models.Index(fields=['origin', 'created'], name='approved_origin_created'),
+        ),
+        migrations.AddIndex(
+            model_name='approved',
+            index=models.Index(fields=['by_api', 'created'], name='approved_byapi_created'),
+        ),
+        migrations.AddIndex(
+            model_name='deleted',
+            index=models.Index(fields=['origin', 'created'], name='deleted_origin_created'),
+        ),
+        migrations.AddIndex(
+            model_name='deleted',
+            index=models.Index(fields=['by_api', 'created'], name='deleted_byapi_created'),
+        ),
+        migrations.AddIndex(
+            model_name='pending',
+            index=models.Index(fields=['origin', 'created'], name='pending_origin_created'),
+        ),
+        migrations.AddIndex(
+            model_name='rejected',
+            index=models.Index(fields=['origin', 'created'], name='rejected_origin_created'),
+        ),
+        migrations.AddIndex(
+            model_name='rejected',
+            index=models.Index(fields=['by_api', 'created'], name='rejected_byapi_created'),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.0.4 on 2018-06-11 10:12
+from __future__ import unicode_literals
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# Columns searched in each table, the message weighting more than the rest
+SEARCHED = (
+    ('datasets_approved', ('message', 'suggestion')),
+    ('datasets_rejected', ('message', 'suggestion', 'reason')),
+)
+
+
+def postgres_vector(columns, row):
+    weighted = [f"setweight(to_tsvector('portuguese', coalesce({row}{column}, '')), '{'A' if column == 'message' else 'B'}')" for column in columns]
+    return ' || '.join(weighted)
+
+
+def create_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table, columns in SEARCHED:
+        if vendor == 'postgresql':
+            schema_editor.execute(f"""
+                CREATE FUNCTION {table}_search_vector() RETURNS trigger AS $$
+                BEGIN
+                    NEW.search_vector := {postgres_vector(columns, 'NEW.')};
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql
+            """)
+            schema_editor.execute(f"CREATE TRIGGER {table}_search_vector BEFORE INSERT OR UPDATE ON {table} FOR EACH ROW EXECUTE PROCEDURE {table}_search_vector()")
+            schema_editor.execute(f"UPDATE {table} SET search_vector = {postgres_vector(columns, '')}")
+            schema_editor.execute(f"CREATE INDEX {table}_search_vector ON {table} USING gin (search_vector)")
+
+        elif vendor == 'sqlite':
+            # External content FTS5 table kept in sync by triggers, as in the SQLite docs
+            listed = ', '.join(columns)
+            new = ', '.join('new.' + column for column in columns)
+            old = ', '.join('old.' + column for column in columns)
+            schema_editor.execute(f"CREATE VIRTUAL TABLE {table}_fts USING fts5({listed}, content='{table}', content_rowid='id', tokenize='unicode61')")
+            schema_editor.execute(f"CREATE TRIGGER {table}_fts_insert AFTER INSERT ON {table} BEGIN INSERT INTO {table}_fts(rowid, {listed}) VALUES (new.id, {new}); END")
+            schema_editor.execute(f"CREATE TRIGGER {table}_fts_delete AFTER DELETE ON {table} BEGIN INSERT INTO {table}_fts({table}_fts, rowid, {listed}) VALUES ('delete', old.id, {old}); END")
+            schema_editor.execute(f"CREATE TRIGGER {table}_fts_update AFTER UPDATE OF {listed} ON {table} BEGIN INSERT INTO {table}_fts({table}_fts, rowid, {listed}) VALUES ('delete', old.id, {old}); INSERT INTO {table}_fts(rowid, {listed}) VALUES (new.id, {new}); END")
+            schema_editor.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')")
+
+
+def drop_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table, columns in SEARCHED:
+        if vendor == 'postgresql':
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {table}_search_vector ON {table}")
+            schema_editor.execute(f"DROP FUNCTION IF EXISTS {table}_search_vector()")
+        elif vendor == 'sqlite':
+            for trigger in ('insert', 'delete', 'update'):
+                schema_editor.execute(f"DROP TRIGGER IF EXISTS {table}_fts_{trigger}")
+            schema_editor.execute(f"DROP TABLE IF EXISTS {table}_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0009_dataset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='approved',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='rejected',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.0.4 on 2018-06-11 16:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0010_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='approved',
+            index=models.Index(fields=['created', 'id'], name='approved_created_id'),
+        ),
+        migrations.AddIndex(
+            model_name='rejected',
+            index=models.Index(fields=['created', 'id'], name='rejected_created_id'),
+        ),
+    ]
@@ -1,8 +1,12 @@
-from django.db import models
+from collections import Counter
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
 from django.contrib import admin
 from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchVectorField
+from django.utils import timezone
 from rest_framework.authtoken.models import Token
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 # Create your models here.
 
 
@@ -13,6 +17,11 @@ class Pending(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     origin = models.CharField(max_length=30, default='spottedunicamp')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['origin', 'created'], name='pending_origin_created'),
+        ]
+
     def __str__(self):
         return "Pending " + str(self.id)
 
@@ -25,6 +34,16 @@ class Approved(models.Model):
     by_api = models.BooleanField(default=False)
     origin = models.CharField(max_length=30, default='spottedunicamp')
 
+    # Maintained by a database trigger on Postgres, see api.filters.FullTextSearchFilter
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['origin', 'created'], name='approved_origin_created'),
+            models.Index(fields=['by_api', 'created'], name='approved_byapi_created'),
+            models.Index(fields=['created', 'id'], name='approved_created_id'),
+        ]
+
     def __str__(self):
         return "Approved " + str(self.id)
 
@@ -38,6 +57,16 @@ class Rejected(models.Model):
     reason = models.CharField(max_length=100)
     origin = models.CharField(max_length=30, default='spottedunicamp')
 
+    # Maintained by a database trigger on Postgres, see api.filters.FullTextSearchFilter
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['origin', 'created'], name='rejected_origin_created'),
+            models.Index(fields=['by_api', 'created'], name='rejected_byapi_created'),
+            models.Index(fields=['created', 'id'], name='rejected_created_id'),
+        ]
+
     def __str__(self):
         return "Rejected " + str(self.id)
 
@@ -52,10 +81,36 @@ class Deleted(models.Model):
     by = models.CharField(max_length=100)
     origin = models.CharField(max_length=30, default='spottedunicamp')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['origin', 'created'], name='deleted_origin_created'),
+            models.Index(fields=['by_api', 'created'], name='deleted_byapi_created'),
+        ]
+
     def __str__(self):
         return "Deleted " + str(self.id)
 
 
+# Number of spotteds in each state by origin, by_api, reason and day,
+# kept up to date as spotteds are created and deleted
+class SpottedCounter(models.Model):
+    state = models.CharField(max_length=10)
+    origin = models.CharField(max_length=30)
+    by_api = models.BooleanField(default=False)
+    reason = models.CharField(max_length=100, blank=True, default='')
+    day = models.DateField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('state', 'origin', 'by_api', 'reason', 'day')
+        indexes = [
+            models.Index(fields=['day']),
+        ]
+
+    def __str__(self):
+        return "SpottedCounter " + str(self.id)
+
+
 class NotEval(models.Model):
     message = models.TextField()
     spam = models.BooleanField(default=False)
@@ -88,3 +143,54 @@ def create_user_token(sender, instance, created, **kwargs):
 
 
 post_save.connect(create_user_token, sender=User)
+
+
+COUNTED_STATES = {
+    Approved: 'approved',
+    Rejected: 'rejected',
+    Deleted: 'deleted',
+    Pending: 'pending',
+}
+
+
+def counter_key(instance):
+    return {
+        'state': COUNTED_STATES[type(instance)],
+        'origin': instance.origin,
+        'by_api': getattr(instance, 'by_api', False),
+        'reason': getattr(instance, 'reason', ''),
+        'day': timezone.localdate(instance.created),
+    }
+
+
+def count_spotteds(instances, delta=1):
+    """Count Spotteds
+    adds delta to the counters of each spotted
+
+    bulk_create sends no signals, so spotteds written with it are counted
+    by calling this explicitly
+    """
+    keys = Counter(tuple(sorted(counter_key(n).items())) for n in instances)
+    with transaction.atomic():
+        for key, amount in keys.items():
+            key = dict(key)
+            if not SpottedCounter.objects.filter(**key).update(count=F('count') + amount * delta):
+                try:
+                    with transaction.atomic():
+                        SpottedCounter.objects.create(count=amount * delta, **key)
+                except IntegrityError:
+                    SpottedCounter.objects.filter(**key).update(count=F('count') + amount * delta)
+
+
+def count_saved(sender, instance, created, **kwargs):
+    if created:
+        count_spotteds([instance], 1)
+
+
+def count_deleted(sender, instance, **kwargs):
+    count_spotteds([instance], -1)
+
+
+for model in COUNTED_STATES:
+    post_save.connect(count_saved, sender=model)
+    post_delete.connect(count_deleted, sender=model)
@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+
+# Sent with the spotteds of a model saved at once by bulk_create, which sends no post_save
+spotteds_created = Signal(providing_args=['instances'])
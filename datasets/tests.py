@@ -1,3 +1,176 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+from datetime import date, datetime, timezone
+from unittest import skipUnless
 
-# Create your tests here.
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from .checks import check_deferred_writes
+from .export import export, export_fields, parquet_available
+from .models import Approved, Deleted, Pending, Rejected, SpottedCounter
+from .serializers import ApprovedSerializer, DeletedSerializer, PendingSerializer, RejectedSerializer, ValuesSerializer
+from .writer import Spool, create_spotteds, write_rows
+
+
+def approved_row(id, message):
+    return ('datasets.Approved', {'id': id, 'message': message, 'is_safe': True, 'suggestion': 'Postar', 'by_api': True, 'origin': 'spottedunicamp'})
+
+
+class SpoolTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spool = Spool(os.path.join(self.directory, 'spool.sqlite3'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_drain_writes_and_removes_rows_in_order(self):
+        self.spool.append([approved_row(i, f'spotted {i}') for i in range(1, 6)])
+        written = []
+        self.assertEqual(self.spool.drain(written.extend, 3), 3)
+        self.assertEqual(self.spool.drain(written.extend, 3), 2)
+        self.assertEqual(self.spool.drain(written.extend, 3), 0)
+        self.assertEqual([fields['id'] for _, fields in written], [1, 2, 3, 4, 5])
+
+    def test_appending_does_not_wait_for_the_write(self):
+        self.spool.append([approved_row(1, 'first')])
+
+        def write(rows):
+            # Fails if the spool is still locked by the drain
+            spool = Spool(self.spool.path)
+            spool.connect = lambda: sqlite3.connect(spool.path, timeout=0.1, isolation_level=None)
+            spool.append([approved_row(2, 'second')])
+            write_rows(rows)
+
+        self.assertEqual(self.spool.drain(write, 10), 1)
+        self.assertEqual(self.spool.drain(write_rows, 10), 1)
+        self.assertEqual(sorted(Approved.objects.values_list('id', flat=True)), [1, 2])
+
+    def test_claimed_rows_are_not_taken_twice(self):
+        self.spool.append([approved_row(i, f'spotted {i}') for i in range(1, 5)])
+        _, first = self.spool.claim(2)
+        _, second = self.spool.claim(10)
+        self.assertEqual([seq for seq, _, _ in first], [1, 2])
+        self.assertEqual([seq for seq, _, _ in second], [3, 4])
+
+    def test_failed_writes_are_retried(self):
+        self.spool.append([approved_row(1, 'spotted')])
+
+        def fail(rows):
+            raise IOError
+
+        with self.assertRaises(IOError):
+            self.spool.drain(fail, 10)
+        self.assertEqual(self.spool.drain(write_rows, 10), 1)
+        self.assertTrue(Approved.objects.filter(id=1).exists())
+
+    def test_expired_claims_are_taken_over(self):
+        self.spool.append([approved_row(1, 'spotted')])
+        self.spool.claim(10)
+        self.assertEqual(self.spool.claim(10)[1], [])
+
+        self.spool.lease = -1
+        self.assertEqual(len(self.spool.claim(10)[1]), 1)
+
+    def test_rows_written_before_are_skipped(self):
+        write_rows([approved_row(1, 'spotted')])
+        write_rows([approved_row(1, 'spotted'), approved_row(2, 'another')])
+        self.assertEqual(Approved.objects.count(), 2)
+
+
+class DeferredWritesCheckTests(TestCase):
+
+    def test_needs_postgresql(self):
+        with override_settings(DEFERRED_WRITES=False):
+            self.assertEqual(check_deferred_writes(None), [])
+        with override_settings(DEFERRED_WRITES=True):
+            self.assertEqual([error.id for error in check_deferred_writes(None)], ['datasets.E001'])
+
+
+class ValuesSerializerTests(TestCase):
+
+    def test_gives_the_same_json_as_the_serializers(self):
+        Pending.objects.create(message='moderar')
+        Approved.objects.create(message='spotted', by_api=True, suggestion='Postar')
+        Rejected.objects.create(message='spam', reason='Spam', origin='outra')
+        Deleted.objects.create(message='apagado', reason='Me arrependi', by='author')
+
+        for serializer_class in (PendingSerializer, ApprovedSerializer, RejectedSerializer, DeletedSerializer):
+            with self.subTest(serializer_class.__name__):
+                queryset = serializer_class.Meta.model.objects.all()
+                values = ValuesSerializer(serializer_class)
+                self.assertEqual(values.to_representation(queryset.values(*values.values)), serializer_class(queryset, many=True).data)
+
+
+class ExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Approved.objects.bulk_create([Approved(message=f'spotted {i}, "com aspas"', origin='spottedunicamp') for i in range(5)])
+        Approved.objects.create(message='de outra página', origin='outra')
+        Approved.objects.filter(message='spotted 0, "com aspas"').update(created=datetime(2018, 1, 1, tzinfo=timezone.utc))
+
+    def test_ndjson_has_one_object_per_row(self):
+        rows = [json.loads(line) for line in b''.join(export('approved', chunk_size=2)).decode('utf-8').splitlines()]
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(set(rows[0]), set(export_fields(Approved)))
+        self.assertNotIn('search_vector', rows[0])
+
+    def test_csv_has_a_header_and_quotes_messages(self):
+        rows = list(csv.reader(io.StringIO(b''.join(export('approved', 'csv', origin='spottedunicamp', chunk_size=2)).decode('utf-8'))))
+        self.assertEqual(rows[0], export_fields(Approved))
+        self.assertEqual(len(rows), 6)
+        self.assertIn('spotted 1, "com aspas"', rows[2])
+
+    def test_dates_limit_the_rows(self):
+        chunks = export('approved', since=date(2018, 1, 2))
+        self.assertEqual(len(b''.join(chunks).splitlines()), 5)
+        chunks = export('approved', until=date(2018, 1, 1))
+        self.assertEqual(len(b''.join(chunks).splitlines()), 1)
+
+    @skipUnless(parquet_available(), "needs pyarrow")
+    def test_parquet_has_one_row_group_per_chunk(self):
+        import pyarrow.parquet as pq
+
+        table = pq.ParquetFile(io.BytesIO(b''.join(export('approved', 'parquet', chunk_size=4))))
+        self.assertEqual(table.metadata.num_rows, 6)
+        self.assertEqual(table.num_row_groups, 2)
+
+    def test_command_writes_a_file(self):
+        with tempfile.NamedTemporaryFile(suffix='.ndjson') as f:
+            call_command('export_dataset', 'approved', '--origin', 'outra', '--file', f.name)
+            self.assertEqual(json.loads(f.read().decode('utf-8'))['message'], 'de outra página')
+
+
+class SpottedCounterTests(TestCase):
+
+    def counts(self):
+        counts = {}
+        for state, reason, count in SpottedCounter.objects.values_list('state', 'reason', 'count'):
+            counts[state, reason] = counts.get((state, reason), 0) + count
+        return counts
+
+    def test_saved_and_deleted_spotteds_are_counted(self):
+        approved = Approved.objects.create(message='spotted', by_api=True)
+        Rejected.objects.create(message='spam', reason='Spam')
+        Rejected.objects.create(message='mais spam', reason='Spam')
+        Deleted.objects.create(message='apagado', reason='Me arrependi', by='author')
+        self.assertEqual(self.counts(), {('approved', ''): 1, ('rejected', 'Spam'): 2, ('deleted', 'Me arrependi'): 1})
+
+        approved.delete()
+        self.assertEqual(self.counts()[('approved', '')], 0)
+
+    def test_bulk_created_spotteds_are_counted_once(self):
+        create_spotteds([Approved(message='spotted'), Pending(message='moderar'), Rejected(message='spam', reason='Spam')])
+        write_rows([approved_row(10, 'spotted'), approved_row(11, 'outro')])
+        write_rows([approved_row(11, 'outro')])
+
+        self.assertEqual(self.counts(), {('approved', ''): 3, ('pending', ''): 1, ('rejected', 'Spam'): 1})
+        self.assertEqual(sorted(SpottedCounter.objects.filter(state='approved').values_list('by_api', 'count')), [(False, 1), (True, 2)])
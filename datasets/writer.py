@@ -0,0 +1,282 @@
+import atexit
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connections, router, transaction
+
+from .models import COUNTED_STATES, Approved, Pending, Rejected, count_spotteds
+from .signals import spotteds_created
+
+
+logger = logging.getLogger(__name__)
+
+
+def reserve_ids(model, count):
+    """Reserve Ids
+    takes count ids from the sequence of a model, so rows can be answered
+    for before they are written
+
+    returns None if the database has no sequences to take them from
+    """
+    connection = connections[router.db_for_write(model)]
+    if connection.vendor != 'postgresql':
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+            [model._meta.db_table, count]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+class Spool(object):
+    """Spool
+    durable queue of rows waiting to be written, in a local SQLite file
+
+    shared by every worker of the machine, so rows spooled by a worker that
+    died are written by the next one to flush. A worker claims the rows it
+    writes for lease seconds, after which another one may take them over
+    """
+
+    def __init__(self, path, lease=300):
+        self.path = path
+        self.lease = lease
+        conn = self.connect()
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS spool (seq INTEGER PRIMARY KEY AUTOINCREMENT, model TEXT, fields TEXT, claim TEXT, claimed REAL)")
+            # Spools created before rows were claimed
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(spool)")]
+            for column, type in (('claim', 'TEXT'), ('claimed', 'REAL')):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE spool ADD COLUMN {column} {type}")
+        finally:
+            conn.close()
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def append(self, rows):
+        """Append
+        spools (model label, fields) rows
+        """
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("INSERT INTO spool (model, fields) VALUES (?, ?)", [(label, json.dumps(fields)) for label, fields in rows])
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def claim(self, limit):
+        """Claim
+        takes up to limit rows no other worker is writing
+
+        returns the claim and its (seq, model label, fields) rows
+        """
+        claim, now = uuid.uuid4().hex, time.time()
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT seq, model, fields FROM spool WHERE claimed IS NULL OR claimed < ? ORDER BY seq LIMIT ?",
+                (now - self.lease, limit)
+            ).fetchall()
+            conn.executemany("UPDATE spool SET claim = ?, claimed = ? WHERE seq = ?", [(claim, now, seq) for seq, _, _ in rows])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return claim, [(seq, label, json.loads(fields)) for seq, label, fields in rows]
+
+    def release(self, claim, done):
+        """Release
+        removes the rows of a claim once written, or gives them back to be retried
+        """
+        conn = self.connect()
+        try:
+            if done:
+                conn.execute("DELETE FROM spool WHERE claim = ?", (claim,))
+            else:
+                conn.execute("UPDATE spool SET claim = NULL, claimed = NULL WHERE claim = ?", (claim,))
+        finally:
+            conn.close()
+
+    def drain(self, write, limit):
+        """Drain
+        passes up to limit spooled rows to write and removes them once it returns
+
+        the spool is only locked while the rows are claimed and removed, so
+        appending never waits for the database write
+
+        returns the number of rows written
+        """
+        claim, rows = self.claim(limit)
+        if not rows:
+            return 0
+        try:
+            write([(label, fields) for _, label, fields in rows])
+        except Exception:
+            self.release(claim, done=False)
+            raise
+        self.release(claim, done=True)
+        return len(rows)
+
+
+def create_spotteds(instances):
+    """Create Spotteds
+    saves new spotteds with one INSERT per model, counting them
+
+    databases that do not return the ids of bulk inserted rows get one INSERT
+    per spotted instead, so that every instance has its id afterwards
+    """
+    connection = connections[router.db_for_write(Pending)]
+    with transaction.atomic():
+        if connection.features.can_return_ids_from_bulk_insert:
+            for model in (Approved, Rejected, Pending):
+                created = model.objects.bulk_create([n for n in instances if isinstance(n, model)])
+                spotteds_created.send(sender=model, instances=created)
+            count_spotteds(instances)
+        else:
+            # Saved one by one, the signals count them
+            for n in instances:
+                n.save()
+
+
+def write_rows(rows):
+    """Write Rows
+    writes spooled rows with one bulk_create per model
+
+    rows already written, by a flush interrupted before it could clear the
+    spool, are skipped
+    """
+    grouped = {}
+    for label, fields in rows:
+        grouped.setdefault(label, []).append(fields)
+
+    with transaction.atomic():
+        for label, objects in grouped.items():
+            model = apps.get_model(label)
+            instances = [model(**fields) for fields in objects]
+            try:
+                with transaction.atomic():
+                    model.objects.bulk_create(instances)
+            except IntegrityError:
+                existing = set(model.objects.filter(id__in=[n.id for n in instances]).values_list('id', flat=True))
+                instances = [n for n in instances if n.id not in existing]
+                model.objects.bulk_create(instances)
+            spotteds_created.send(sender=model, instances=instances)
+            if model in COUNTED_STATES:
+                count_spotteds(instances)
+
+
+class DeferredWriter(object):
+    """Deferred Writer
+    answers for new rows right away and writes them in batches from a
+    background thread, going through the spool so that nothing is lost if
+    the worker restarts
+    """
+
+    def __init__(self, spool_path, batch_size, interval):
+        self.spool = Spool(spool_path)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+                atexit.register(self.flush)
+
+    def submit(self, instances):
+        """Submit
+        reserves ids for unsaved instances and spools them
+
+        returns False, without doing anything, if ids can not be reserved
+        """
+        by_model = {}
+        for n in instances:
+            by_model.setdefault(type(n), []).append(n)
+
+        for model, objects in by_model.items():
+            ids = reserve_ids(model, len(objects))
+            if ids is None:
+                return False
+            for n, id in zip(objects, ids):
+                n.id = id
+
+        self.spool.append([
+            (n._meta.label, {f.attname: getattr(n, f.attname) for f in n._meta.concrete_fields if not getattr(f, 'auto_now_add', False)})
+            for n in instances
+        ])
+        self.start()
+        self.wakeup.set()
+        return True
+
+    def flush(self):
+        """Flush
+        writes every spooled row now
+        """
+        while self.spool.drain(write_rows, self.batch_size):
+            pass
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                # Rows stay spooled and are retried on the next round
+                logger.exception("Could not write the deferred rows")
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Get Writer
+    returns the process wide deferred writer, or None unless DEFERRED_WRITES is on
+    """
+    global _writer
+    if not settings.DEFERRED_WRITES:
+        return None
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = DeferredWriter(settings.DEFERRED_WRITES_SPOOL, settings.DEFERRED_WRITES_BATCH, settings.DEFERRED_WRITES_INTERVAL)
+                _writer.start()
+    return _writer
+
+
+def defer(instances):
+    """Defer
+    hands unsaved instances to the deferred writer, which sets their ids
+
+    returns False if they were not deferred and must be saved right away
+    """
+    writer = get_writer()
+    return writer is not None and writer.submit(instances)
+
+
+def flush():
+    """Flush
+    writes the deferred rows now, if there are any
+    """
+    writer = get_writer()
+    if writer is not None:
+        writer.flush()
@@ -1,5 +1,16 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_save, post_delete
 
 
 class ProcessingConfig(AppConfig):
     name = 'processing'
+
+    def ready(self):
+        from datasets.signals import spotteds_created
+        from .duplicates import KINDS, index_created, index_saved, index_deleted
+
+        # Keep the duplicate index of this process up to date
+        for model in KINDS:
+            post_save.connect(index_saved, sender=model)
+            spotteds_created.connect(index_created, sender=model)
+            post_delete.connect(index_deleted, sender=model)
@@ -0,0 +1,205 @@
+import json
+import os
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.preprocessing import normalize
+
+
+ARTIFACT_FORMAT = 1
+
+# Files of each classifier head, prefixed by the head name when an artifact has several
+HEAD_FILES = ('feature_log_prob.npy', 'class_log_prior.npy', 'classes.npy')
+
+
+def head_file(head, name):
+    return name if head is None else head + '.' + name
+
+
+def artifact_files(heads=(None,)):
+    """Artifact Files
+    returns the files of an artifact with the given heads
+    """
+    return ['meta.json', 'vocabulary.npy'] + [head_file(head, name) for head in heads for name in HEAD_FILES]
+
+
+def exportable_features(vectorizer, tfidf):
+    return (
+        isinstance(vectorizer, CountVectorizer) and vectorizer.analyzer == 'word' and
+        vectorizer.preprocessor is None and vectorizer.tokenizer is None and
+        isinstance(tfidf, TfidfTransformer) and not tfidf.use_idf
+    )
+
+
+def exportable(pipeline):
+    """Exportable
+    wether a pipeline can be exported as a compact artifact
+
+    only CountVectorizer -> TfidfTransformer(use_idf=False) -> MultinomialNB is supported
+    """
+    steps = pipeline.named_steps
+    return exportable_features(steps.get('vectorizer'), steps.get('tfidf')) and isinstance(steps.get('classifier'), MultinomialNB)
+
+
+def export_heads(vectorizer, tfidf, heads, path):
+    """Export Heads
+    writes a vectorizer and the classifiers sharing it as a directory of plain numpy arrays
+
+    vocabulary.npy: the sorted vocabulary, as UTF-8 bytes
+    feature_log_prob.npy: one row of class log probabilities per vocabulary entry
+    class_log_prior.npy, classes.npy: the class priors and labels
+    meta.json: what is needed to tokenize and weight terms like the original
+    vectorizer and transformer
+
+    heads: dict of MultinomialNB by head name, None for an artifact with a single one
+    """
+    terms = sorted(vectorizer.vocabulary_)
+    columns = [vectorizer.vocabulary_[term] for term in terms]
+
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'vocabulary.npy'), np.array([term.encode('utf-8') for term in terms], dtype=np.bytes_))
+    for head, classifier in heads.items():
+        np.save(os.path.join(path, head_file(head, 'feature_log_prob.npy')), np.ascontiguousarray(classifier.feature_log_prob_[:, columns].T))
+        np.save(os.path.join(path, head_file(head, 'class_log_prior.npy')), classifier.class_log_prior_)
+        np.save(os.path.join(path, head_file(head, 'classes.npy')), np.array([str(label) for label in classifier.classes_]))
+
+    meta = {
+        'format': ARTIFACT_FORMAT,
+        'vectorizer': {
+            'strip_accents': vectorizer.strip_accents,
+            'lowercase': vectorizer.lowercase,
+            'token_pattern': vectorizer.token_pattern,
+            'stop_words': sorted(vectorizer.stop_words) if vectorizer.stop_words else None,
+            'ngram_range': list(vectorizer.ngram_range),
+            'binary': vectorizer.binary,
+        },
+        'sublinear_tf': tfidf.sublinear_tf,
+        'norm': tfidf.norm,
+        'heads': list(heads),
+    }
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+
+def export_pipeline(pipeline, path):
+    """Export Pipeline
+    writes a fitted pipeline as a compact artifact with a single head
+    """
+    if not exportable(pipeline):
+        raise ValueError("Only CountVectorizer/TfidfTransformer/MultinomialNB pipelines can be exported")
+
+    steps = pipeline.named_steps
+    export_heads(steps['vectorizer'], steps['tfidf'], {None: steps['classifier']}, path)
+
+
+class CompactModel(object):
+    """Compact Model
+    a read-only classifier loaded from an exported artifact
+
+    the arrays are memory mapped, so every process using the same artifact
+    shares its pages through the OS cache and only the rows of the tokens
+    actually seen are ever read
+    """
+
+    def __init__(self, path, mmap_mode='r'):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['format'] != ARTIFACT_FORMAT:
+            raise ValueError(f"Unsupported artifact format {meta['format']}")
+
+        self.path = path
+        self.norm = meta['norm']
+        # Artifacts exported before these were written counted raw terms
+        self.binary = meta['vectorizer'].get('binary', False)
+        self.sublinear_tf = meta.get('sublinear_tf', False)
+        self.analyzer = CountVectorizer(analyzer='word', **dict(meta['vectorizer'], ngram_range=tuple(meta['vectorizer']['ngram_range']))).build_analyzer()
+        self.vocabulary = np.load(os.path.join(path, 'vocabulary.npy'), mmap_mode=mmap_mode)
+        self.heads = {
+            head: (
+                np.load(os.path.join(path, head_file(head, 'feature_log_prob.npy')), mmap_mode=mmap_mode),
+                np.load(os.path.join(path, head_file(head, 'class_log_prior.npy'))),
+                np.load(os.path.join(path, head_file(head, 'classes.npy'))),
+            )
+            for head in meta.get('heads', [None])
+        }
+
+    @property
+    def classes_(self):
+        return self.heads[None][2]
+
+    def features(self, X):
+        """Features
+        returns the weighted and normalized term counts of each document as
+        a sparse matrix, as CountVectorizer and TfidfTransformer(use_idf=False)
+        """
+        indptr, indices = [0], []
+        for document in X:
+            tokens = np.array([token.encode('utf-8') for token in self.analyzer(document)], dtype=np.bytes_)
+            if len(tokens):
+                positions = np.searchsorted(self.vocabulary, tokens)
+                positions[positions == len(self.vocabulary)] = 0
+                indices.extend(positions[self.vocabulary[positions] == tokens])
+            indptr.append(len(indices))
+
+        features = sparse.csr_matrix(
+            (np.ones(len(indices)), np.array(indices, dtype=np.int64), np.array(indptr)),
+            shape=(len(indptr) - 1, len(self.vocabulary))
+        )
+        features.sum_duplicates()
+        if self.binary:
+            features.data.fill(1)
+        if self.sublinear_tf:
+            np.log(features.data, features.data)
+            features.data += 1
+        return normalize(features, norm=self.norm) if self.norm else features
+
+    def head_log_proba(self, features, head=None):
+        feature_log_prob, class_log_prior, _ = self.heads[head]
+        jll = features.dot(feature_log_prob) + class_log_prior
+        return jll - np.logaddexp.reduce(jll, axis=1, keepdims=True)
+
+    def head_predict_proba(self, features, head=None):
+        return np.exp(self.head_log_proba(features, head))
+
+    def head_predict(self, features, head=None):
+        return self.heads[head][2][np.argmax(self.head_log_proba(features, head), axis=1)]
+
+    def predict_log_proba(self, X):
+        return self.head_log_proba(self.features(X))
+
+    def predict_proba(self, X):
+        return self.head_predict_proba(self.features(X))
+
+    def predict(self, X):
+        return self.head_predict(self.features(X))
+
+
+class CombinedClassifier(object):
+    """Combined Classifier
+    several classifiers sharing one fitted feature extraction step
+
+    exposes the same head_* interface as a CompactModel with several heads
+    """
+
+    def __init__(self, features, heads):
+        self.feature_steps = features
+        self.heads = heads
+
+    def exportable(self):
+        steps = self.feature_steps.named_steps
+        return exportable_features(steps.get('vectorizer'), steps.get('tfidf')) and all(isinstance(c, MultinomialNB) for c in self.heads.values())
+
+    def export(self, path):
+        steps = self.feature_steps.named_steps
+        export_heads(steps['vectorizer'], steps['tfidf'], self.heads, path)
+
+    def features(self, X):
+        return self.feature_steps.transform(X)
+
+    def head_predict_proba(self, features, head=None):
+        return self.heads[head].predict_proba(features)
+
+    def head_predict(self, features, head=None):
+        return self.heads[head].predict(features)
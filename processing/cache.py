@@ -0,0 +1,137 @@
+import hashlib
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def normalize_text(text):
+    """Normalize Text
+    strips accents, lowercases and collapses whitespace, so that spotteds the
+    classifiers can not tell apart share the same cache entry
+    """
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.lower().split())
+
+
+class LocalBackend(object):
+    """Local Backend
+    LRU cache with expiration kept in the memory of the process
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        found = {}
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                if entry[0] < now:
+                    del self.entries[key]
+                    continue
+                self.entries.move_to_end(key)
+                found[key] = entry[1]
+        return found
+
+    def set_many(self, values):
+        expires = time.monotonic() + self.ttl
+        with self.lock:
+            for key, value in values.items():
+                self.entries[key] = (expires, value)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class DjangoBackend(object):
+    """Django Backend
+    stores predictions in one of the Django caches, shared by every worker
+    """
+
+    def __init__(self, alias, ttl):
+        self.alias = alias
+        self.ttl = ttl
+
+    def get_many(self, keys):
+        return caches[self.alias].get_many(keys)
+
+    def set_many(self, values):
+        caches[self.alias].set_many(values, timeout=self.ttl)
+
+    def clear(self):
+        # Entries of older models are never read again and expire on their own
+        pass
+
+
+class PredictionCache(object):
+    """Prediction Cache
+    caches analysis results by normalized text and model version, counting
+    hits and misses
+
+    keys include the version of the models, so loading a new classifier
+    invalidates every previous entry
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text, version):
+        digest = hashlib.sha1((version + '\n' + normalize_text(text)).encode('utf-8')).hexdigest()
+        return 'spotted_analysis:' + digest
+
+    def get_many(self, keys):
+        found = self.backend.get_many(keys) if self.backend is not None else {}
+        hits = sum(1 for key in keys if key in found)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return found
+
+    def set_many(self, values):
+        if self.backend is not None:
+            self.backend.set_many(values)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+_prediction_cache = None
+
+
+def get_prediction_cache():
+    """Get Prediction Cache
+    returns the process wide prediction cache configured by PREDICTION_CACHE
+
+    'local' keeps predictions in memory, 'django' in the PREDICTION_CACHE_ALIAS
+    Django cache and 'none' disables caching
+    """
+    global _prediction_cache
+    if _prediction_cache is None:
+        if settings.PREDICTION_CACHE == 'local':
+            backend = LocalBackend(settings.PREDICTION_CACHE_SIZE, settings.PREDICTION_CACHE_TTL)
+        elif settings.PREDICTION_CACHE == 'django':
+            backend = DjangoBackend(settings.PREDICTION_CACHE_ALIAS, settings.PREDICTION_CACHE_TTL)
+        else:
+            backend = None
+        _prediction_cache = PredictionCache(backend)
+    return _prediction_cache
@@ -0,0 +1,311 @@
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Max
+
+from datasets.models import Approved, Rejected, Pending
+from .cache import normalize_text
+
+
+logger = logging.getLogger(__name__)
+
+# MinHash signatures of NUM_PERM values, split in BANDS bands for the LSH buckets
+NUM_PERM = 32
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+
+# Length of the character shingles
+SHINGLE = 5
+
+# Entries kept out of the sorted arrays until they are merged in
+MERGE_SIZE = 1000
+
+# Models indexed, by the code stored in the index
+KINDS = (Approved, Rejected, Pending)
+
+_PRIME = (1 << 31) - 1
+_random = np.random.RandomState(20180601)
+_A = _random.randint(1, _PRIME, NUM_PERM).astype(np.uint64)
+_B = _random.randint(0, _PRIME, NUM_PERM).astype(np.uint64)
+_BAND_MIX = (_random.randint(1, _PRIME, ROWS).astype(np.uint64) << np.uint64(1)) | np.uint64(1)
+
+
+def shingles(text):
+    """Shingles
+    returns the set of character shingles of the normalized text, without punctuation
+    """
+    text = ' '.join(re.findall(r'\w+', normalize_text(text)))
+    if len(text) <= SHINGLE:
+        return {text}
+    return {text[i:i + SHINGLE] for i in range(len(text) - SHINGLE + 1)}
+
+
+def signature(text):
+    """Signature
+    returns the MinHash signature of a text
+    """
+    hashes = np.array([zlib.crc32(s.encode('utf-8')) for s in shingles(text)], dtype=np.uint64) % np.uint64(_PRIME)
+    return ((np.outer(hashes, _A) + _B) % np.uint64(_PRIME)).min(axis=0).astype(np.uint32)
+
+
+def band_keys(signatures):
+    """Band Keys
+    returns the bucket of each band of each signature, as a (n, BANDS) array
+    """
+    bands = signatures.reshape(-1, BANDS, ROWS).astype(np.uint64)
+    return ((bands * _BAND_MIX).sum(axis=2) >> np.uint64(32)).astype(np.uint32)
+
+
+class DuplicateIndex(object):
+    """Duplicate Index
+    locality sensitive index of the MinHash signatures of every spotted
+
+    each band of a signature is a bucket key, kept in sorted arrays so that
+    a lookup is one binary search per band. Only the spotteds sharing a
+    bucket are compared, by the fraction of equal signature values, which
+    estimates the Jaccard similarity of their shingles. New entries go to a
+    small buffer, merged into the sorted arrays every MERGE_SIZE entries
+    """
+
+    def __init__(self):
+        self.kinds = np.empty(0, dtype=np.uint8)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.signatures = np.empty((0, NUM_PERM), dtype=np.uint32)
+        self.keys = np.empty((BANDS, 0), dtype=np.uint32)
+        self.entries = np.empty((BANDS, 0), dtype=np.int64)
+        self.buffer = []
+        self.removed = set()
+        # Highest id read by refresh, and the newer ones already added by this process
+        self.last_ids = [0] * len(KINDS)
+        self.added = set()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids) + len(self.buffer) - len(self.removed)
+
+    def add(self, model, id, message):
+        self.add_many(model, [(id, message)])
+
+    def add_many(self, model, rows):
+        """Add Many
+        indexes (id, message) rows saved by this process
+
+        the ones refresh has not read yet are remembered, so that it skips them
+        """
+        kind = KINDS.index(model)
+        entries = [(kind, id, signature(message)) for id, message in rows]
+        with self.lock:
+            self.buffer += entries
+            self.added.update((kind, id) for _, id, _ in entries if id > self.last_ids[kind])
+            if len(self.buffer) >= MERGE_SIZE:
+                self.merge()
+
+    def remove(self, model, id):
+        with self.lock:
+            self.removed.add((KINDS.index(model), id))
+
+    def extend(self, kinds, ids, signatures):
+        """Extend
+        adds many entries to the sorted arrays at once
+
+        the new band keys are sorted on their own and inserted into the
+        existing ones, which are never sorted again
+        """
+        offset = len(self.ids)
+        self.kinds = np.concatenate([self.kinds, kinds])
+        self.ids = np.concatenate([self.ids, ids])
+        self.signatures = np.concatenate([self.signatures, signatures])
+
+        new_keys = band_keys(signatures).T
+        order = np.argsort(new_keys, axis=1, kind='mergesort')
+        new_keys = new_keys[np.arange(BANDS)[:, None], order]
+
+        keys, entries = [], []
+        for band in range(BANDS):
+            positions = np.searchsorted(self.keys[band], new_keys[band], side='right')
+            keys.append(np.insert(self.keys[band], positions, new_keys[band]))
+            entries.append(np.insert(self.entries[band], positions, order[band] + offset))
+        self.keys = np.array(keys, dtype=np.uint32).reshape(BANDS, -1)
+        self.entries = np.array(entries, dtype=np.int64).reshape(BANDS, -1)
+
+    def merge(self):
+        if self.buffer:
+            kinds, ids, signatures = zip(*self.buffer)
+            self.buffer = []
+            self.extend(np.array(kinds, dtype=np.uint8), np.array(ids, dtype=np.int64), np.array(signatures, dtype=np.uint32))
+
+    def compact(self):
+        """Compact
+        drops the removed entries from the sorted arrays
+        """
+        self.merge()
+        if self.removed:
+            removed = np.array([(kind << 56) | id for kind, id in self.removed], dtype=np.int64)
+            keep = ~np.isin((self.kinds.astype(np.int64) << 56) | self.ids, removed)
+            kinds, ids, signatures = self.kinds[keep], self.ids[keep], self.signatures[keep]
+            self.kinds, self.ids, self.signatures = kinds[:0], ids[:0], signatures[:0]
+            self.keys = np.empty((BANDS, 0), dtype=np.uint32)
+            self.entries = np.empty((BANDS, 0), dtype=np.int64)
+            self.extend(kinds, ids, signatures)
+            self.removed = set()
+
+    def query(self, message, threshold=None):
+        """Query
+        returns (model, id, similarity) of the most similar spotted, or None if
+        no spotted is at least threshold similar
+        """
+        threshold = settings.DUPLICATE_THRESHOLD if threshold is None else threshold
+        sig = signature(message)
+        keys = band_keys(sig)[0]
+
+        with self.lock:
+            candidates = set()
+            for band in range(BANDS):
+                start, end = np.searchsorted(self.keys[band], keys[band], side='left'), np.searchsorted(self.keys[band], keys[band], side='right')
+                candidates.update(self.entries[band, start:end].tolist())
+
+            matches = []
+            if candidates:
+                candidates = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+                similarities = (self.signatures[candidates] == sig).mean(axis=1)
+                matches += [(self.kinds[i], self.ids[i], s) for i, s in zip(candidates, similarities) if s >= threshold]
+            for kind, id, other in self.buffer:
+                similarity = (other == sig).mean()
+                if similarity >= threshold:
+                    matches.append((kind, id, similarity))
+
+            matches = [m for m in matches if (m[0], m[1]) not in self.removed]
+
+        if not matches:
+            return None
+        kind, id, similarity = max(matches, key=lambda m: m[2])
+        return KINDS[kind], int(id), float(similarity)
+
+    def refresh(self, chunk_size=2000):
+        """Refresh
+        indexes the spotteds saved since the last refresh by other processes
+
+        the ones this process added itself are skipped, they are indexed already
+        """
+        for kind, model in enumerate(KINDS):
+            rows = model.objects.filter(id__gt=self.last_ids[kind]).order_by('id').values_list('id', 'message')
+            ids, signatures, last_id = [], [], None
+            for id, message in rows.iterator(chunk_size=chunk_size):
+                last_id = id
+                if (kind, id) not in self.added:
+                    ids.append(id)
+                    signatures.append(signature(message))
+            if last_id is not None:
+                with self.lock:
+                    if ids:
+                        self.extend(np.full(len(ids), kind, dtype=np.uint8), np.array(ids, dtype=np.int64), np.array(signatures, dtype=np.uint32))
+                    self.last_ids[kind] = max(self.last_ids[kind], last_id)
+                    self.added = {(k, id) for k, id in self.added if id > self.last_ids[k]}
+
+        # Deleted spotteds are dropped once enough of them pile up
+        if len(self.removed) >= MERGE_SIZE:
+            with self.lock:
+                self.compact()
+        return self
+
+    def refresh_every(self, interval):
+        """Refresh Every
+        keeps refreshing the index from a background thread
+        """
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except Exception:
+                    logger.exception("Could not refresh the duplicate index")
+                finally:
+                    close_old_connections()
+
+        threading.Thread(target=run, name='duplicate-index-refresh', daemon=True).start()
+        return self
+
+    def skip_existing(self):
+        """Skip Existing
+        makes refresh only index the spotteds saved from now on
+        """
+        for kind, model in enumerate(KINDS):
+            self.last_ids[kind] = model.objects.aggregate(last=Max('id'))['last'] or 0
+        return self
+
+    def save(self, path):
+        with self.lock:
+            self.compact()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                np.savez(f, kinds=self.kinds, ids=self.ids, signatures=self.signatures, keys=self.keys, entries=self.entries, last_ids=np.array(self.last_ids))
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with np.load(path) as data:
+            index.kinds = data['kinds']
+            index.ids = data['ids']
+            index.signatures = data['signatures']
+            index.keys = data['keys']
+            index.entries = data['entries']
+            index.last_ids = data['last_ids'].tolist()
+        return index
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_duplicate_index():
+    """Get Duplicate Index
+    returns the process wide duplicate index
+
+    it is loaded from the snapshot that rebuild_duplicate_index saves at
+    DUPLICATE_INDEX_PATH, and catches up with the database from a background
+    thread every DUPLICATE_INDEX_REFRESH seconds. Without a snapshot only the
+    spotteds saved from then on are indexed
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                path = settings.DUPLICATE_INDEX_PATH
+                if os.path.exists(path):
+                    index = DuplicateIndex.load(path)
+                else:
+                    logger.warning("No duplicate index at %s, run rebuild_duplicate_index to find duplicates of older spotteds", path)
+                    index = DuplicateIndex().skip_existing()
+                _index = index.refresh_every(settings.DUPLICATE_INDEX_REFRESH)
+    return _index
+
+
+def find_duplicate(message):
+    """Find Duplicate
+    returns (model, id, similarity) of a near-duplicate of the message, if any
+    """
+    if not settings.DUPLICATE_DETECTION:
+        return None
+    return get_duplicate_index().query(message)
+
+
+def index_saved(sender, instance, created, **kwargs):
+    if created and _index is not None:
+        _index.add(sender, instance.id, instance.message)
+
+
+def index_created(sender, instances, **kwargs):
+    if _index is not None:
+        _index.add_many(sender, [(n.id, n.message) for n in instances])
+
+
+def index_deleted(sender, instance, **kwargs):
+    if _index is not None:
+        _index.remove(sender, instance.id)
@@ -1,32 +1,69 @@
+import logging
 import os
+from functools import lru_cache
 
-from datasets.models import Approved, Rejected
+from datasets.export import chunked
+from datasets.models import Approved, Deleted, Rejected
+from django.db.models import Max
 import numpy as np
 import pandas as pd
-import requests
 import pickle
-import boto
-from boto.s3.key import Key
+import shutil
 from django.conf import settings
 
+from .artifacts import CompactModel, artifact_files, export_pipeline, exportable
+from .storage import get_store
 
-def get_data(approved=True, detail=False, clean=True, filter_origin='spottedunicamp'):
+
+logger = logging.getLogger(__name__)
+
+
+DATA_COLUMNS = ['message', 'reason', 'suggestion']
+
+
+def iter_data(approved=True, filter_origin='spottedunicamp', chunk_size=2000):
+    """Iter Data
+    streams spotteds from the database as columnar chunks
+
+    yields dicts mapping each of DATA_COLUMNS to a tuple of at most chunk_size
+    values, reading only those fields straight from the database cursor
+
+    approved: approved or rejected spotteds
+    """
+
+    model = Approved if approved else Rejected
+    data = model.objects.all() if not filter_origin else model.objects.filter(origin=filter_origin)
+
+    fields = ('message', 'suggestion') if approved else ('message', 'reason', 'suggestion')
+    rows = data.values_list(*fields).iterator(chunk_size=chunk_size)
+
+    for chunk in chunked(rows, chunk_size):
+        columns = list(zip(*chunk))
+        yield {
+            'message': columns[0],
+            'reason': ("aprovado",) * len(chunk) if approved else columns[1],
+            'suggestion': columns[-1],
+        }
+
+
+def get_data(approved=True, detail=False, clean=True, filter_origin='spottedunicamp', chunk_size=2000):
     """Get Data
-    returns a numpy array of dicts containing spotteds as specified
+    returns a DataFrame containing spotteds as specified
 
     approved: approved or rejected spotteds
     detail: wether or not to return the detailed reject reason
     """
 
-    if approved:
-        data = Approved.objects.all() if not filter_origin else Approved.objects.filter(origin=filter_origin)
-    else:
-        data = Rejected.objects.all() if not filter_origin else Rejected.objects.filter(origin=filter_origin)
+    columns = {column: [] for column in DATA_COLUMNS}
+    for chunk in iter_data(approved, filter_origin, chunk_size):
+        for column in DATA_COLUMNS:
+            columns[column].extend(chunk[column])
+    data = pd.DataFrame(columns, columns=DATA_COLUMNS)
 
     if approved:
-        return pd.DataFrame([[x.message, "aprovado", x.suggestion] for x in data], columns=['message', "reason", "suggestion"])
+        return data
     else:
-        rejected = pd.DataFrame([[x.message, x.reason, x.suggestion] for x in data], columns=['message', "reason", "suggestion"])
+        rejected = data
         if clean:
             rejected = clean_details(rejected)
         if detail:
@@ -34,25 +71,122 @@ def get_data(approved=True, detail=False, clean=True, filter_origin='spottedunic
         return rejected.replace({'reason': {'^(.*?)$': 'rejeitado'}}, regex=True)
 
 
+def iter_training_data(detailed=False, filter_origin='spottedunicamp', chunk_size=2000, ratio=1):
+    """Iter Training Data
+    streams the dataset of a classifier as (messages, labels) chunks, for
+    classifiers that learn chunk by chunk with partial_fit
+
+    holds a single chunk in memory, unlike get_data. Rejected spotteds with
+    unknown reasons are skipped as in clean_details and, for the binary
+    dataset, approved spotteds are sampled to about ratio times as many as
+    the rejected ones, as in merge_data
+    """
+
+    def rejected_chunks(label=None):
+        for chunk in iter_data(False, filter_origin, chunk_size):
+            rows = [(message, REASON_LABELS[reason]) for message, reason in zip(chunk['message'], chunk['reason']) if reason in REASON_LABELS]
+            if rows:
+                messages, labels = zip(*rows)
+                yield list(messages), [label] * len(messages) if label else list(labels)
+
+    if detailed:
+        yield from rejected_chunks()
+        return
+
+    rejected = Rejected.objects.filter(reason__in=list(REASON_LABELS))
+    approved = Approved.objects.all()
+    if filter_origin:
+        rejected, approved = rejected.filter(origin=filter_origin), approved.filter(origin=filter_origin)
+    keep = min(1.0, rejected.count() * ratio / max(approved.count(), 1))
+
+    yield from rejected_chunks('rejeitado')
+    for chunk in iter_data(True, filter_origin, chunk_size):
+        messages = [message for message, sampled in zip(chunk['message'], np.random.random(len(chunk['message'])) < keep) if sampled]
+        if messages:
+            yield messages, ['aprovado'] * len(messages)
+
+
+# Moderation decisions the online classifiers learn from, by position key
+MODERATED = (('approved', Approved), ('rejected', Rejected), ('deleted', Deleted))
+
+
+def moderation_positions():
+    """Moderation Positions
+    returns the id of the last approved, rejected and deleted spotted
+    """
+    return {key: model.objects.aggregate(last=Max('id'))['last'] or 0 for key, model in MODERATED}
+
+
+def iter_moderation_data(after, until, detailed=False, chunk_size=2000):
+    """Iter Moderation Data
+    streams the moderation decisions taken between two positions as
+    (messages, labels) chunks
+
+    approvals and rejections made by the API are not decisions, so they are
+    skipped, and deletions only count when their reason is a reject reason
+
+    after, until: positions as returned by moderation_positions
+    """
+    for key, model in MODERATED:
+        if detailed and model is Approved:
+            continue
+        data = model.objects.filter(id__gt=after[key], id__lte=until[key]).order_by('id')
+        if model is not Deleted:
+            data = data.filter(by_api=False)
+        fields = ('message',) if model is Approved else ('message', 'reason')
+
+        for chunk in chunked(data.values_list(*fields).iterator(chunk_size=chunk_size), chunk_size):
+            if model is Approved:
+                rows = [(message, 'aprovado') for message, in chunk]
+            elif model is Rejected and not detailed:
+                rows = [(message, 'rejeitado') for message, _ in chunk]
+            else:
+                rows = [(message, REASON_LABELS[reason] if detailed else 'rejeitado') for message, reason in chunk if reason in REASON_LABELS]
+            if rows:
+                messages, labels = zip(*rows)
+                yield list(messages), list(labels)
+
+
+# Labels used by the detailed classifier and the raw reject reasons merged into them
+DETAILS_REJ = [
+    ("Ofensivo", ["Ofensivo ou Ódio", "Bullying individual"]),
+    ("Spam", ["Corrente ou spam", "Conteúdo comercial", "Spam / Propaganda"]),
+    ("Obsceno", ["Obsceno ou Assédio"]),
+    ("Assédio", []),
+    ("Off-topic", []),
+    ("Depressivo", []),
+]
+
+# Lookup from every known reason, raw or already merged, to its label
+REASON_LABELS = {label: label for label, _ in DETAILS_REJ}
+REASON_LABELS.update({raw: label for label, raws in DETAILS_REJ for raw in raws})
+
+
+def normalize_reason(reason):
+    """Normalize Reason
+    returns the label a raw reject reason is merged into
+
+    unknown reasons are returned unchanged
+    """
+    return REASON_LABELS.get(reason, reason)
+
+
+def normalize_reasons(reasons):
+    """Normalize Reasons
+    maps a Series of raw reject reasons to their labels in a single pass
+
+    unknown reasons become NaN
+    """
+    return reasons.map(REASON_LABELS)
+
+
 def clean_details(df):
     """Clean Details
-    merges and removes unwanted columns
-    """
-    details_rej = [
-        ("Ofensivo", ["Ofensivo ou Ódio", "Bullying individual"]),
-        ("Spam", ["Corrente ou spam", "Conteúdo comercial", "Spam / Propaganda"]),
-        ("Obsceno", ["Obsceno ou Assédio"]),
-        ("Assédio", [False]),
-        ("Off-topic", [False]),
-        ("Depressivo", [False])
-    ]
-    res = pd.DataFrame()
-    for t in details_rej:
-        for c in t[1]:
-            if t[0]:
-                df = df.replace({'reason': {c: t[0]}})
-        res = res.append(df[df['reason'] == t[0]], ignore_index=True)
-    return res
+    merges the reject reasons into their labels and removes unknown ones
+    """
+    reasons = normalize_reasons(df['reason'])
+    known = reasons.notna()
+    return df[known].assign(reason=reasons[known]).reset_index(drop=True)
 
 
 def rand_reindex(arr):
@@ -71,55 +205,142 @@ def merge_data(approved, rejected, ratio=1):
 
     approved = rand_reindex(approved)
     approved = approved.iloc[:(round(len(rejected) * ratio))]
-    return rand_reindex(approved.append(rejected, ignore_index=True))
+    return rand_reindex(pd.concat([approved, rejected], ignore_index=True))
 
 
-def stop_words():
-    response = requests.get("https://gist.githubusercontent.com/alopes/5358189/raw/2107d809cca6b83ce3d8e04dbd9463283025284f/stopwords.txt")
-    return response.text.split()
+STOPWORDS_DIR = os.path.join(os.path.dirname(__file__), 'stopwords')
 
+STOPWORDS_URL = "https://gist.githubusercontent.com/alopes/5358189/raw/{revision}/stopwords.txt"
 
-def reload_classifier(class_type, detailed):
-    """Reload Classifier
-    Reloads a classifier looking for it locally and in S3
+
+def stop_words_path(revision=None):
+    """Stop Words Path
+    returns the path of the packaged stopword list for a gist revision
+    """
+    return os.path.join(STOPWORDS_DIR, (revision or settings.STOPWORDS_REVISION) + '.txt')
+
+
+@lru_cache(maxsize=None)
+def _read_stop_words(revision):
+    with open(stop_words_path(revision), encoding='utf-8') as f:
+        return tuple(f.read().split())
+
+
+def stop_words(revision=None):
+    """Stop Words
+    returns the packaged stopword list, read from disk only once per process
+    """
+    return list(_read_stop_words(revision or settings.STOPWORDS_REVISION))
+
+
+# Kinds that are another name for the same classifier, and share its artifacts
+CLASSIFIER_ALIASES = {'svm': 'linear_svm'}
+
+
+def classifier_name(class_type, detailed=False, combined=False):
+    """Classifier Name
+    returns the name of a classifier artifact
+    """
+    class_type = CLASSIFIER_ALIASES.get(class_type, class_type)
+    return 'classifier_' + class_type + ('_combined' if combined else '_detailed' if detailed else '')
+
+
+def classifier_path(class_type, detailed=False, combined=False):
+    """Classifier Path
+    returns the local path of a classifier, without extension
+    """
+    return os.path.join(get_store().cache_dir, classifier_name(class_type, detailed, combined))
+
+
+def classifier_version(class_type, detailed=False, combined=False):
+    """Classifier Version
+    returns the version of the classifier in the local cache, if it has one
+    """
+    return get_store().version(classifier_name(class_type, detailed, combined))
+
+
+def load_artifact(name):
+    """Load Artifact
+    loads an artifact from the local cache, preferring the compact format
+    over the pickle
 
     if it does not find it, return None
     """
-    custom_path = class_type + ('_detailed' if detailed else '')
+    ARTIFACT_PATH = os.path.join(get_store().cache_dir, name)
 
-    CLASSIFIER_PATH = 'processing/classifiers/classifier_' + custom_path + '.pkl'
+    if os.path.exists(os.path.join(ARTIFACT_PATH, 'meta.json')):
+        return CompactModel(ARTIFACT_PATH)
+    if os.path.exists(ARTIFACT_PATH + '.pkl'):
+        return pickle.load(open(ARTIFACT_PATH + '.pkl', 'rb'), encoding='utf-8')
+    return None
 
-    # Try to find it locally
-    if os.path.exists(CLASSIFIER_PATH):
-        return pickle.load(open(CLASSIFIER_PATH, 'rb'), encoding='utf-8')
 
-    # Try to find it on S3
-    conn = boto.connect_s3(settings.S3_KEY, settings.S3_SECRET)
-    bucket = conn.get_bucket(settings.S3_BUCKET)
-    try:
-        k = Key(bucket, CLASSIFIER_PATH)
-        k.get_contents_to_filename(CLASSIFIER_PATH)
-        return pickle.load(open(CLASSIFIER_PATH, 'rb'), encoding='utf-8')
-    except:
-        return None
+def save_artifact(name, obj, export=None, heads=(None,)):
+    """Save Artifact
+    pickles an object to the local cache and publishes it to the artifact store
+
+    export: function writing the compact version of the object to a directory, if it has one
+    """
+    ARTIFACT_PATH = os.path.join(get_store().cache_dir, name)
+
+    pickle.dump(obj, open(ARTIFACT_PATH + '.pkl', "wb"))
+    files = [name + '.pkl']
+
+    if export is not None:
+        export(ARTIFACT_PATH)
+        files += [name + '/' + f for f in artifact_files(heads)]
+    elif os.path.exists(ARTIFACT_PATH):
+        shutil.rmtree(ARTIFACT_PATH)
+
+    get_store().publish(name, files)
+
+
+def reload_classifier(class_type, detailed):
+    """Reload Classifier
+    Reloads a classifier from the local artifact cache
+    """
+    return load_artifact(classifier_name(class_type, detailed))
 
 
 def save_classifier(classifier, class_type, detailed):
     """Save Classifier
-    Saves a classifier to memory so that it can be easily accessed later
+    Saves a classifier to the local cache and publishes it to the artifact store
+
+    pipelines that can be exported are also saved as a compact artifact
     """
+    export = (lambda path: export_pipeline(classifier, path)) if exportable(classifier) else None
+    save_artifact(classifier_name(class_type, detailed), classifier, export)
 
-    custom_path = class_type + ('_detailed' if detailed else '')
 
-    CLASSIFIER_PATH = 'processing/classifiers/classifier_' + custom_path + '.pkl'
+def reload_combined(class_type):
+    """Reload Combined
+    Reloads the combined binary and detailed classifier from the local artifact cache
+    """
+    return load_artifact(classifier_name(class_type, combined=True))
+
 
-    pickle.dump(classifier, open(CLASSIFIER_PATH, "wb"))
+def save_combined(classifier, class_type):
+    """Save Combined
+    Saves a CombinedClassifier to the local cache and publishes it to the artifact store
+    """
+    export = classifier.export if classifier.exportable() else None
+    save_artifact(classifier_name(class_type, combined=True), classifier, export, list(classifier.heads))
 
-    with open(CLASSIFIER_PATH, 'rb') as f:
 
-        conn = boto.connect_s3(settings.S3_KEY, settings.S3_SECRET)
-        bucket = conn.get_bucket(settings.S3_BUCKET)
+def sync_classifiers(kinds=None, fail_silently=False):
+    """Sync Classifiers
+    brings the local cache up to date with the artifact store
 
-        k = Key(bucket)
-        k.key = CLASSIFIER_PATH
-        k.set_contents_from_file(f)
+    meant to run when a worker boots, so requests never download anything
+
+    fail_silently: log the artifacts that could not be synced and keep their
+    local copies instead of raising
+    """
+    for kind in kinds or [settings.SPOTTED_CLASSIFIER]:
+        for name in (classifier_name(kind), classifier_name(kind, detailed=True), classifier_name(kind, combined=True)):
+            try:
+                get_store().sync(name)
+            except Exception:
+                if not fail_silently:
+                    raise
+                logger.exception("Could not sync %s, using the local copy", name)
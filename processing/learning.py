@@ -1,11 +1,60 @@
+import threading
+import uuid
+
 from sklearn.base import TransformerMixin
 from sklearn.pipeline import Pipeline
-from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.feature_extraction.text import TfidfTransformer
-from sklearn.svm import SVC
+from sklearn.svm import LinearSVC
+from sklearn.calibration import CalibratedClassifierCV
+
+from django.conf import settings
+
+from .cache import get_prediction_cache
+from .helpers import DETAILS_REJ, stop_words, get_data, iter_training_data, merge_data, moderation_positions, rand_reindex, reload_classifier, save_classifier, classifier_version, reload_combined
+
+
+# Classifiers that can learn incrementally with partial_fit
+ONLINE_CLASSIFIERS = ('nb_online',)
+
+# Size of the feature space of the online classifiers
+HASHING_FEATURES = 2 ** 18
+
+
+def build_classifier(classifier='nb'):
+    """Build Classifier
+    returns an unfitted estimator for the given classifier kind
+
+    linear_svm, also known as svm, trains a primal linear SVM and calibrates
+    its decision function, so it supports predict_proba. Both names share the
+    same artifacts, see classifier_name
+    """
+    if classifier in ('nb',) + ONLINE_CLASSIFIERS:
+        return MultinomialNB()
+    return CalibratedClassifierCV(LinearSVC(C=1.0), method='sigmoid', cv=3)
+
+
+def build_pipeline(classifier='nb'):
+    """Build Pipeline
+    returns an unfitted pipeline for the given classifier kind
+
+    online classifiers use a stateless HashingVectorizer, which needs no
+    vocabulary and so can keep learning after the first fit
+    """
+    stopwords = stop_words()
 
-from .helpers import stop_words, get_data, merge_data, rand_reindex, reload_classifier, save_classifier
+    if classifier in ONLINE_CLASSIFIERS:
+        return Pipeline([
+            ('vectorizer', HashingVectorizer(strip_accents='ascii', analyzer='word', stop_words=stopwords, ngram_range=(1, 2), n_features=HASHING_FEATURES, alternate_sign=False)),
+            ('classifier', build_classifier(classifier)),
+        ])
+
+    return Pipeline([
+        ('vectorizer', CountVectorizer(strip_accents='ascii', analyzer='word', stop_words=stopwords, ngram_range=(1, 2))),
+        ('tfidf', TfidfTransformer(use_idf=False)),
+        ('classifier', build_classifier(classifier)),
+    ])
 
 
 class SpottedAnalyzer(TransformerMixin):
@@ -27,14 +76,15 @@ class SpottedAnalyzer(TransformerMixin):
 
         # If the classifier was not loaded, fit the model
         if loaded_classifier is None:
-            stopwords = stop_words()
-            self.pipeline = Pipeline([
-                ('vectorizer', CountVectorizer(strip_accents='ascii', analyzer='word', stop_words=stopwords, ngram_range=(1, 2))),
-                ('tfidf', TfidfTransformer(use_idf=False)),
-                ('classifier', MultinomialNB() if self.classifier == 'nb' else SVC(C=10, kernel='linear')),
-            ])
-
-            if not self.detailed and X is None:
+            self.pipeline = build_pipeline(self.classifier)
+
+            if self.online and X is None:
+                # Online classifiers learn chunk by chunk, never loading the whole dataset,
+                # and then keep learning from the decisions taken after this position
+                self.pipeline.learned_positions = moderation_positions()
+                for messages, labels in iter_training_data(self.detailed):
+                    self.partial_fit(messages, labels)
+            elif not self.detailed and X is None:
                 tmp = merge_data(get_data(), get_data(False))
                 self.X = tmp['message']
                 self.y = tmp['reason']
@@ -44,9 +94,13 @@ class SpottedAnalyzer(TransformerMixin):
                 self.y = tmp['reason']
             else:
                 self.X = X
+                self.y = y
 
             # Fit it
-            self.pipeline.fit(self.X, self.y)
+            if self.online and X is not None:
+                self.partial_fit(self.X, self.y)
+            elif not self.online:
+                self.pipeline.fit(self.X, self.y)
 
             # Save it
             save_classifier(self.pipeline, self.classifier, self.detailed)
@@ -55,17 +109,181 @@ class SpottedAnalyzer(TransformerMixin):
         else:
             self.pipeline = loaded_classifier
 
+        self.version = classifier_version(self.classifier, self.detailed) or uuid.uuid4().hex
+
+        return self
+
+    @property
+    def online(self):
+        return self.classifier in ONLINE_CLASSIFIERS
+
+    @property
+    def classes(self):
+        if self.detailed:
+            return [label for label, _ in DETAILS_REJ]
+        return ['aprovado', 'rejeitado']
+
+    def partial_fit(self, X, y):
+        """Partial Fit
+        folds newly labeled spotteds into an online classifier
+
+        resident models are never updated in place, see processing.online
+        """
+        features = self.pipeline.named_steps['vectorizer'].transform(X)
+        self.pipeline.named_steps['classifier'].partial_fit(features, y, classes=self.classes)
+        self.version = uuid.uuid4().hex
         return self
 
     def transform(self, X, prob=False):
         return self.pipeline.predict(X) if not prob else self.pipeline.predict_proba(X)
 
 
+# Resident models, one per (classifier, detailed or 'combined') pair and per process
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_model(kind=None, detailed=False):
+    """Get Model
+    returns the resident SpottedAnalyzer for the given classifier kind,
+    SPOTTED_CLASSIFIER by default
+
+    the first call on each process loads (or fits) the pipeline, every
+    following call reuses the one kept in memory
+    """
+    key = (kind or settings.SPOTTED_CLASSIFIER, detailed)
+    model = _models.get(key)
+    if model is None:
+        with _models_lock:
+            model = _models.get(key)
+            if model is None:
+                model = SpottedAnalyzer(classifier=key[0], detailed=detailed).fit()
+                _models[key] = model
+    return model
+
+
+def reload_model(kind=None, detailed=False):
+    """Reload Model
+    replaces a resident model with the one in the local artifact cache
+
+    the new model is loaded aside and swapped in, so requests keep using the
+    previous one until it is ready
+    """
+    key = (kind or settings.SPOTTED_CLASSIFIER, detailed)
+    model = SpottedAnalyzer(classifier=key[0], detailed=detailed).fit()
+    with _models_lock:
+        _models[key] = model
+    return model
+
+
+def get_combined_model(kind=None):
+    """Get Combined Model
+    returns the resident combined binary and detailed classifier for the
+    given classifier kind, or None if there is none
+
+    online classifiers keep learning separately, so they are never combined
+    """
+    kind = kind or settings.SPOTTED_CLASSIFIER
+    if kind in ONLINE_CLASSIFIERS:
+        return None
+
+    key = (kind, 'combined')
+    model = _models.get(key)
+    if model is None:
+        with _models_lock:
+            model = _models.get(key)
+            if model is None:
+                model = reload_combined(kind) or False
+                if model:
+                    model.version = classifier_version(kind, combined=True) or uuid.uuid4().hex
+                _models[key] = model
+    return model or None
+
+
+def load_models(kind=None):
+    """Load Models
+    loads the combined model, or both the binary and the detailed models,
+    so that the first request does not pay for it
+    """
+    if get_combined_model(kind) is None:
+        get_model(kind)
+        get_model(kind, detailed=True)
+
+
+def reset_models():
+    """Reset Models
+    drops every resident model, forcing them to be reloaded on next use
+    """
+    with _models_lock:
+        _models.clear()
+    get_prediction_cache().clear()
+
+
 def spotted_analysis(spotted):
-    results = SpottedAnalyzer().fit().transform([spotted], prob=True)
+    return spotted_analysis_batch([spotted])[0]
+
 
-    if results[0][0] > 0.5:
-        return True, 'Postar', results[0][0]
+def spotted_analysis_batch(spotteds):
+    """Spotted Analysis Batch
+    analyses many spotteds at once, answering repeated ones from the
+    prediction cache
+
+    returns a list of (publish, suggestion, percentage) in the same order
+    """
+    spotteds = list(spotteds)
+    if not spotteds:
+        return []
 
+    cache = get_prediction_cache()
+    combined = get_combined_model()
+    if combined is not None:
+        version = combined.version
     else:
-        return False, SpottedAnalyzer(detailed=True).fit().transform([spotted])[0], results[0][0]
+        version = get_model().version + ':' + get_model(detailed=True).version
+    keys = [cache.key(spotted, version) for spotted in spotteds]
+    results = cache.get_many(keys)
+
+    # Analyse each distinct spotted that is not cached only once
+    missing = {}
+    for key, spotted in zip(keys, spotteds):
+        if key not in results:
+            missing.setdefault(key, spotted)
+    if missing:
+        analyse = _analyse if combined is None else _analyse_combined
+        analysed = dict(zip(missing, analyse(list(missing.values()))))
+        cache.set_many(analysed)
+        results.update(analysed)
+
+    return [results[key] for key in keys]
+
+
+def _analyse(spotteds):
+    """Analyses spotteds with one prediction over all of them and one
+    detailed prediction over the rejected ones only."""
+    percentages = get_model().transform(spotteds, prob=True)[:, 0]
+    results = [(True, 'Postar', float(percentage)) for percentage in percentages]
+
+    rejected = [i for i, percentage in enumerate(percentages) if not percentage > 0.5]
+    if rejected:
+        reasons = get_model(detailed=True).transform([spotteds[i] for i in rejected])
+        for i, reason in zip(rejected, reasons):
+            results[i] = (False, str(reason), float(percentages[i]))
+
+    return results
+
+
+def _analyse_combined(spotteds):
+    """Analyses spotteds with the combined model, extracting their features
+    only once for both the binary and the detailed heads."""
+    combined = get_combined_model()
+    features = combined.features(spotteds)
+    percentages = combined.head_predict_proba(features, 'binary')[:, 0]
+    results = [(True, 'Postar', float(percentage)) for percentage in percentages]
+
+    rejected = [i for i, percentage in enumerate(percentages) if not percentage > 0.5]
+    if rejected:
+        reasons = combined.head_predict(features[rejected], 'detailed')
+        for i, reason in zip(rejected, reasons):
+            results[i] = (False, str(reason), float(percentages[i]))
+
+    return results
@@ -0,0 +1,62 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from sklearn.svm import SVC
+from processing.helpers import get_data, merge_data, rand_reindex
+from processing.learning import build_pipeline
+
+
+def build_baseline(kind):
+    """Build Baseline
+    returns the pipeline of a classifier kind, or of svc, the kernel SVC the
+    svm kind used to train, kept here as the baseline to compare against
+    """
+    if kind != 'svc':
+        return build_pipeline(kind)
+    pipeline = build_pipeline('nb')
+    pipeline.steps[-1] = ('classifier', SVC(C=10, kernel='linear', probability=True))
+    return pipeline
+
+
+class Command(BaseCommand):
+    help = 'Compares fit time, predict latency and accuracy of the classifiers on the stored spotteds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kinds', nargs='+', default=['svc', 'linear_svm', 'nb'], help='Classifier kinds to compare, svc being the old kernel SVC')
+        parser.add_argument('--sizes', nargs='+', type=int, default=[], help='Training set sizes to try, all the data by default')
+        parser.add_argument('--detailed', action='store_true', help='Benchmark the detailed classifiers')
+        parser.add_argument('--test-ratio', type=float, default=0.2)
+        parser.add_argument('--latency-samples', type=int, default=200)
+
+    def handle(self, *args, **options):
+        if options['detailed']:
+            data = rand_reindex(get_data(False, True))
+        else:
+            data = merge_data(get_data(), get_data(False))
+
+        split = int(len(data) * (1 - options['test_ratio']))
+        train, test = data.iloc[:split], data.iloc[split:]
+        samples = list(test['message'].iloc[:options['latency_samples']])
+
+        self.stdout.write(f"{len(train)} training and {len(test)} test spotteds")
+        self.stdout.write(f"{'kind':<12} {'rows':>8} {'fit (s)':>10} {'predict (ms)':>14} {'accuracy':>10}")
+
+        for size in options['sizes'] or [len(train)]:
+            subset = train.iloc[:size]
+            for kind in options['kinds']:
+                pipeline = build_baseline(kind)
+
+                start = time.perf_counter()
+                pipeline.fit(subset['message'], subset['reason'])
+                fit_time = time.perf_counter() - start
+
+                # Latency of a single spotted, the way process_new_post/ calls it
+                start = time.perf_counter()
+                for sample in samples:
+                    pipeline.predict_proba([sample])
+                latency = (time.perf_counter() - start) / max(len(samples), 1)
+
+                accuracy = np.mean(pipeline.predict(test['message']) == test['reason'])
+
+                self.stdout.write(f"{kind:<12} {len(subset):>8} {fit_time:>10.3f} {latency * 1000:>14.3f} {accuracy:>10.3f}")
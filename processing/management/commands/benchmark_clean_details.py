@@ -0,0 +1,35 @@
+import time
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand
+from processing.helpers import REASON_LABELS, clean_details
+
+
+class Command(BaseCommand):
+    help = 'Times clean_details on synthetic rejected datasets of increasing size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 100000, 1000000])
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        # Every known reason plus ones that get dropped
+        reasons = np.array(list(REASON_LABELS) + ["Repetido", "Mais"], dtype=object)
+
+        self.stdout.write(f"{'rows':>10} {'best (ms)':>12} {'per row (us)':>14}")
+        for size in options['sizes']:
+            df = pd.DataFrame({
+                'message': np.full(size, "spotted", dtype=object),
+                'reason': reasons[np.random.randint(len(reasons), size=size)],
+                'suggestion': np.full(size, "", dtype=object),
+            })
+
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                clean_details(df)
+                timings.append(time.perf_counter() - start)
+
+            best = min(timings)
+            self.stdout.write(f"{size:>10} {best * 1000:>12.2f} {best / size * 1e6:>14.3f}")
@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from datasets.models import Approved, Rejected
+from datasets.serializers import ApprovedSerializer, RejectedSerializer, ValuesSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compares the per row cost of the dataset serializers and of their .values() fast path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[100, 10000])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'serializer':<22} {'rows':>8} {'serializer (us/row)':>20} {'values (us/row)':>16} {'speedup':>8}")
+        for serializer_class, model, extra in ((ApprovedSerializer, Approved, {}), (RejectedSerializer, Rejected, {'reason': "Spam"})):
+            fast = ValuesSerializer(serializer_class)
+            for size in options['sizes']:
+                # The rows the list views get, as instances and as .values() dicts
+                now = timezone.now()
+                instances = [model(id=i, message=f"spotted {i}", suggestion="aprovado", created=now, **extra) for i in range(size)]
+                rows = [{field: getattr(n, field) for field in fast.values} for n in instances]
+
+                if serializer_class(instances[:1], many=True).data != fast.to_representation(rows[:1]):
+                    self.stderr.write(f"{serializer_class.__name__} and its fast path disagree")
+
+                slow_time = self.best(lambda: serializer_class(instances, many=True).data, options['repeat'])
+                fast_time = self.best(lambda: fast.to_representation(rows), options['repeat'])
+                self.stdout.write(
+                    f"{serializer_class.__name__:<22} {size:>8} {slow_time / size * 1e6:>20.2f} "
+                    f"{fast_time / size * 1e6:>16.2f} {slow_time / fast_time:>7.1f}x"
+                )
+
+    def best(self, serialize, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            serialize()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
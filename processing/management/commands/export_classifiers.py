@@ -0,0 +1,29 @@
+import os
+import pickle
+
+from django.core.management.base import BaseCommand
+from processing.artifacts import export_pipeline, exportable
+from processing.helpers import classifier_path
+
+
+class Command(BaseCommand):
+    help = 'Exports the pickled classifiers as compact, memory mappable artifacts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kinds', nargs='+', default=['nb'])
+
+    def handle(self, *args, **options):
+        for kind in options['kinds']:
+            for detailed in (False, True):
+                path = classifier_path(kind, detailed)
+                if not os.path.exists(path + '.pkl'):
+                    self.stdout.write(f"{path}.pkl not found, skipping")
+                    continue
+
+                pipeline = pickle.load(open(path + '.pkl', 'rb'), encoding='utf-8')
+                if not exportable(pipeline):
+                    self.stdout.write(f"{path}.pkl can not be exported, skipping")
+                    continue
+
+                export_pipeline(pipeline, path)
+                self.stdout.write(f"Exported {path}")
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+from processing.online import learn
+
+
+class Command(BaseCommand):
+    help = 'Folds new moderation decisions into the online classifiers and publishes them for the workers to reload'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', default=None, help='Online classifier kind, SPOTTED_CLASSIFIER by default')
+        parser.add_argument('--every', type=int, default=None, help='Keep learning every this many seconds instead of once')
+
+    def handle(self, *args, **options):
+        while True:
+            for name, count in learn(options['kind']).items():
+                self.stdout.write(f"{name}: learned {count} decisions")
+
+            if not options['every']:
+                return
+            time.sleep(options['every'])
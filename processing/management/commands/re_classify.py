@@ -1,15 +1,16 @@
 from django.core.management.base import BaseCommand
-from processing.learning import SpottedAnalyzer
+from processing.training import DEFAULT_KINDS, Retrainer
 
 
 class Command(BaseCommand):
-    help = 'Re-builds the classifier'
+    help = 'Re-builds the classifiers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kinds', nargs='+', default=list(DEFAULT_KINDS), help='Classifier kinds to rebuild')
+        parser.add_argument('--workers', type=int, default=None, help='Number of training processes')
 
     def handle(self, *args, **options):
 
-        SpottedAnalyzer(classifier='nb').fit(reload=False)
-        SpottedAnalyzer(classifier='nb', detailed=True).fit(reload=False)
-        SpottedAnalyzer(classifier='svm').fit(reload=False)
-        SpottedAnalyzer(classifier='svm', detailed=True).fit(reload=False)
+        Retrainer(kinds=options['kinds'], workers=options['workers'], log=self.stdout.write).run()
 
         return "Success"
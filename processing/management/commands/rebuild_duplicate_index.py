@@ -0,0 +1,21 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from processing.duplicates import DuplicateIndex
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the near-duplicate index from the database and saves a snapshot for the workers to boot from'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=None, help='Where to save the snapshot, DUPLICATE_INDEX_PATH by default')
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.DUPLICATE_INDEX_PATH
+
+        start = time.perf_counter()
+        index = DuplicateIndex().refresh()
+        index.save(path)
+
+        self.stdout.write(f"Indexed {len(index)} spotteds in {time.perf_counter() - start:.2f}s, saved to {path}")
@@ -0,0 +1,31 @@
+import hashlib
+import os
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from processing.helpers import STOPWORDS_URL, stop_words_path
+
+
+class Command(BaseCommand):
+    help = 'Downloads a revision of the stopword list and bundles it, verifying its checksum'
+
+    def add_arguments(self, parser):
+        parser.add_argument('revision', help='Gist revision to download')
+        parser.add_argument('--sha256', required=True, help='Expected SHA-256 of the downloaded file')
+
+    def handle(self, *args, **options):
+        response = requests.get(STOPWORDS_URL.format(revision=options['revision']), timeout=30)
+        response.raise_for_status()
+
+        digest = hashlib.sha256(response.content).hexdigest()
+        if digest != options['sha256'].lower():
+            raise CommandError(f"Checksum mismatch: expected {options['sha256']}, got {digest}")
+
+        path = stop_words_path(options['revision'])
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(response.content)
+        os.replace(tmp_path, path)
+
+        self.stdout.write(f"Saved {len(response.text.split())} stopwords to {path}")
+        self.stdout.write(f"Set STOPWORDS_REVISION={options['revision']} to use them")
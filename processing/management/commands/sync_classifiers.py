@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from processing.helpers import classifier_name, sync_classifiers
+from processing.storage import get_store
+
+
+class Command(BaseCommand):
+    help = 'Downloads the current classifiers from the artifact store, skipping unchanged ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kinds', nargs='+', default=None)
+
+    def handle(self, *args, **options):
+        kinds = options['kinds'] or [settings.SPOTTED_CLASSIFIER]
+        sync_classifiers(kinds)
+
+        for kind in kinds:
+            for detailed in (False, True):
+                name = classifier_name(kind, detailed)
+                self.stdout.write(f"{name}: {get_store().version(name)}")
@@ -0,0 +1,106 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .helpers import classifier_name, classifier_version, iter_moderation_data, moderation_positions, save_classifier, sync_classifiers
+from .learning import ONLINE_CLASSIFIERS, SpottedAnalyzer, _models, reload_model
+
+
+logger = logging.getLogger(__name__)
+
+
+def learn(kind=None, batch_size=None):
+    """Learn
+    folds the moderation decisions taken since the last checkpoint into the
+    online classifiers and publishes them as a new checkpoint
+
+    meant to run in a single place, the learn_online command, so that every
+    decision is learned once. Workers never update their resident models,
+    they reload them from the checkpoints with watch_models
+
+    returns the number of decisions learned by each classifier
+    """
+    kind = kind or settings.SPOTTED_CLASSIFIER
+    batch_size = batch_size or settings.ONLINE_BATCH_SIZE
+    if kind not in ONLINE_CLASSIFIERS:
+        return {}
+
+    sync_classifiers([kind])
+    learned = {}
+    for detailed in (False, True):
+        model = SpottedAnalyzer(kind, detailed).fit()
+        after = getattr(model.pipeline, 'learned_positions', None)
+        until = moderation_positions()
+
+        count = 0
+        # Checkpoints without a position start learning from now on
+        if after is not None:
+            for messages, labels in iter_moderation_data(after, until, detailed, batch_size):
+                model.partial_fit(messages, labels)
+                count += len(messages)
+
+        if count or after is None:
+            model.pipeline.learned_positions = until
+            save_classifier(model.pipeline, kind, detailed)
+        learned[classifier_name(kind, detailed)] = count
+
+    return learned
+
+
+class ModelWatcher(object):
+    """Model Watcher
+    reloads the resident online classifiers of a worker whenever a new
+    checkpoint is published, every ONLINE_RELOAD_INTERVAL seconds
+    """
+
+    def __init__(self, kind=None, interval=None):
+        self.kind = kind or settings.SPOTTED_CLASSIFIER
+        self.interval = interval or settings.ONLINE_RELOAD_INTERVAL
+
+    def check(self):
+        """Check
+        syncs the checkpoints and reloads the resident models they replace
+
+        returns the reloaded models
+        """
+        sync_classifiers([self.kind])
+
+        reloaded = []
+        for detailed in (False, True):
+            model = _models.get((self.kind, detailed))
+            if model is not None and model.version != classifier_version(self.kind, detailed):
+                reloaded.append(reload_model(self.kind, detailed))
+        return reloaded
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Could not reload the online classifiers")
+            finally:
+                close_old_connections()
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def watch_models():
+    """Watch Models
+    starts reloading the online classifiers of this process in the background
+
+    does nothing unless SPOTTED_CLASSIFIER is an online classifier
+    """
+    global _watcher
+    if settings.SPOTTED_CLASSIFIER not in ONLINE_CLASSIFIERS:
+        return None
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = ModelWatcher()
+            threading.Thread(target=_watcher.run, name='online-model-watcher', daemon=True).start()
+    return _watcher
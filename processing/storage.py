@@ -0,0 +1,229 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import boto
+from boto.s3.key import Key
+from django.conf import settings
+
+
+class DirectoryBackend(object):
+    """Directory Backend
+    keeps artifacts in a local directory
+
+    also works as a stand-in for a remote store in development and tests
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def read(self, key):
+        if not self.exists(key):
+            return None
+        with open(self.path(key), 'rb') as f:
+            return f.read()
+
+    def write(self, key, content):
+        os.makedirs(os.path.dirname(self.path(key)), exist_ok=True)
+        with open(self.path(key), 'wb') as f:
+            f.write(content)
+
+    def upload(self, key, filename):
+        os.makedirs(os.path.dirname(self.path(key)), exist_ok=True)
+        shutil.copyfile(filename, self.path(key))
+
+    def download(self, key, filename):
+        shutil.copyfile(self.path(key), filename)
+
+
+class S3Backend(object):
+    """S3 Backend
+    keeps artifacts in the S3 bucket, through a single connection
+    """
+
+    def __init__(self, key, secret, bucket):
+        self.credentials = (key, secret)
+        self.bucket_name = bucket
+        self._bucket = None
+        self.lock = threading.Lock()
+
+    @property
+    def bucket(self):
+        with self.lock:
+            if self._bucket is None:
+                self._bucket = boto.connect_s3(*self.credentials).get_bucket(self.bucket_name)
+            return self._bucket
+
+    def exists(self, key):
+        return self.bucket.get_key(key) is not None
+
+    def read(self, key):
+        k = self.bucket.get_key(key)
+        return k.get_contents_as_string() if k is not None else None
+
+    def write(self, key, content):
+        Key(self.bucket, key).set_contents_from_string(content)
+
+    def upload(self, key, filename):
+        Key(self.bucket, key).set_contents_from_filename(filename)
+
+    def download(self, key, filename):
+        Key(self.bucket, key).get_contents_to_filename(filename)
+
+
+def file_hash(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def replace_file(path, write):
+    """Replace File
+    writes a file through a temporary file in the same directory, so that
+    processes writing it at the same time never mix their contents and
+    readers never see it half written
+
+    write: function writing the contents to the filename it is given
+    """
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path) or '.', delete=False) as f:
+        temporary = f.name
+    try:
+        write(temporary)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def write_json(filename, content):
+    with open(filename, 'w') as f:
+        json.dump(content, f)
+
+
+class ArtifactStore(object):
+    """Artifact Store
+    keeps a local cache of classifier artifacts in sync with a backend
+
+    every published artifact gets a version, the hash of its files, and is
+    uploaded once under versions/<version>/. A small manifest per artifact
+    points to its current version, so syncing an unchanged artifact only
+    costs reading the manifest, and publishing it again uploads nothing
+
+    backend: where artifacts are published, None to only keep them locally
+    """
+
+    def __init__(self, backend=None, cache_dir='processing/classifiers', prefix='processing/classifiers'):
+        self.backend = backend
+        self.cache_dir = cache_dir
+        self.prefix = prefix
+
+    def local_path(self, name):
+        return os.path.join(self.cache_dir, *name.split('/'))
+
+    def manifest_key(self, artifact):
+        return self.prefix + '/' + artifact + '.json'
+
+    def file_key(self, version, name):
+        return self.prefix + '/versions/' + version + '/' + name
+
+    def local_manifest(self, artifact):
+        try:
+            with open(self.local_path(artifact + '.json')) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def remote_manifest(self, artifact):
+        content = self.backend.read(self.manifest_key(artifact))
+        return json.loads(content.decode('utf-8')) if content else None
+
+    def version(self, artifact):
+        """Version
+        returns the version of the artifact in the local cache, if any
+        """
+        manifest = self.local_manifest(artifact)
+        return manifest['version'] if manifest else None
+
+    def publish(self, artifact, files):
+        """Publish
+        versions files of the local cache as an artifact and uploads them if they changed
+
+        files: paths relative to the cache directory
+        """
+        digest = hashlib.sha256()
+        for name in sorted(files):
+            digest.update(name.encode('utf-8'))
+            digest.update(file_hash(self.local_path(name)).encode('utf-8'))
+        manifest = {'version': digest.hexdigest(), 'files': sorted(files)}
+
+        replace_file(self.local_path(artifact + '.json'), lambda filename: write_json(filename, manifest))
+
+        if self.backend is None:
+            return manifest['version']
+
+        remote = self.remote_manifest(artifact)
+        if remote is None or remote['version'] != manifest['version']:
+            for name in manifest['files']:
+                self.backend.upload(self.file_key(manifest['version'], name), self.local_path(name))
+            self.backend.write(self.manifest_key(artifact), json.dumps(manifest).encode('utf-8'))
+
+        return manifest['version']
+
+    def sync(self, artifact):
+        """Sync
+        downloads the current version of an artifact unless the local cache already has it
+
+        returns the local version
+        """
+        if self.backend is None:
+            return self.version(artifact)
+
+        remote = self.remote_manifest(artifact)
+        if remote is None:
+            return self.version(artifact)
+
+        local = self.local_manifest(artifact)
+        if local == remote and all(os.path.exists(self.local_path(name)) for name in local['files']):
+            return local['version']
+
+        for name in remote['files']:
+            path = self.local_path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            replace_file(path, lambda filename: self.backend.download(self.file_key(remote['version'], name), filename))
+
+        replace_file(self.local_path(artifact + '.json'), lambda filename: write_json(filename, remote))
+        return remote['version']
+
+
+_store = None
+
+
+def get_store():
+    """Get Store
+    returns the process wide artifact store configured by CLASSIFIER_STORE
+
+    's3' publishes to the S3 bucket, 'local' keeps artifacts only on disk and
+    any other value is used as a directory standing in for the bucket
+    """
+    global _store
+    if _store is None:
+        if settings.CLASSIFIER_STORE == 's3':
+            backend = S3Backend(settings.S3_KEY, settings.S3_SECRET, settings.S3_BUCKET)
+        elif settings.CLASSIFIER_STORE == 'local':
+            backend = None
+        else:
+            backend = DirectoryBackend(settings.CLASSIFIER_STORE)
+        _store = ArtifactStore(backend)
+    return _store
@@ -1,3 +1,569 @@
-from django.test import TestCase
+import hashlib
+import os
+import shutil
+import socket
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.pipeline import Pipeline
+from sklearn.svm import SVC
+
+from datasets.models import Approved, Deleted, Rejected
+from datasets.writer import write_rows
+
+from . import cache, duplicates, helpers, learning, storage
+from .artifacts import CombinedClassifier, CompactModel, export_pipeline, exportable
+from .cache import LocalBackend, PredictionCache
+from .duplicates import DuplicateIndex
+from .helpers import REASON_LABELS, STOPWORDS_DIR, classifier_name, classifier_version, clean_details, iter_training_data, normalize_reason, normalize_reasons, save_classifier, stop_words, sync_classifiers
+from .learning import SpottedAnalyzer, build_classifier, build_pipeline, get_model, reset_models
+from .management.commands.benchmark_classifiers import build_baseline
+from .online import ModelWatcher, learn
+from .training import DEFAULT_KINDS, Retrainer
+
+
+class TemporaryStoreMixin(object):
+    """Points the artifact store to a temporary directory."""
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.remote_dir = tempfile.mkdtemp()
+        self.previous_store = storage._store
+        storage._store = storage.ArtifactStore(storage.DirectoryBackend(self.remote_dir), cache_dir=self.cache_dir)
+
+    def tearDown(self):
+        storage._store = self.previous_store
+        shutil.rmtree(self.cache_dir)
+        shutil.rmtree(self.remote_dir)
+        super().tearDown()
+
+
+def create_dataset(origin='spottedunicamp'):
+    Approved.objects.bulk_create([Approved(message=f'linda gata amor {i}', origin=origin) for i in range(6)])
+    Rejected.objects.bulk_create([
+        Rejected(message='compre spam barato', reason='Corrente ou spam', origin=origin),
+        Rejected(message='burro ofensivo idiota', reason='Ofensivo', origin=origin),
+        Rejected(message='spam compre agora', reason='Spam', origin=origin),
+        Rejected(message='sem motivo conhecido', reason='Outro', origin=origin),
+    ])
+
+
+# Reasons and the labels the old clean_details loop merged them into, None when it dropped them
+REASONS_TABLE = [
+    ('Ofensivo', 'Ofensivo'),
+    ('Ofensivo ou Ódio', 'Ofensivo'),
+    ('Bullying individual', 'Ofensivo'),
+    ('Spam', 'Spam'),
+    ('Corrente ou spam', 'Spam'),
+    ('Conteúdo comercial', 'Spam'),
+    ('Spam / Propaganda', 'Spam'),
+    ('Obsceno', 'Obsceno'),
+    ('Obsceno ou Assédio', 'Obsceno'),
+    ('Assédio', 'Assédio'),
+    ('Off-topic', 'Off-topic'),
+    ('Depressivo', 'Depressivo'),
+    ('Outro', None),
+    ('Me arrependi', None),
+    ('spam', None),
+    ('Ofensivo ', None),
+    ('', None),
+]
+
+
+class CleanDetailsTests(TestCase):
+
+    def test_every_reason_is_merged_like_before(self):
+        self.assertEqual(set(REASON_LABELS), {reason for reason, label in REASONS_TABLE if label})
+
+        for reason, label in REASONS_TABLE:
+            with self.subTest(reason):
+                self.assertEqual(normalize_reason(reason), label or reason)
+
+        reasons = pd.Series([reason for reason, _ in REASONS_TABLE])
+        expected = [label for _, label in REASONS_TABLE]
+        self.assertEqual([None if pd.isna(label) else label for label in normalize_reasons(reasons)], expected)
+
+    def test_unknown_reasons_are_dropped(self):
+        df = pd.DataFrame({
+            'message': [f'spotted {i}' for i in range(len(REASONS_TABLE))],
+            'reason': [reason for reason, _ in REASONS_TABLE],
+            'suggestion': ['Rejeitar'] * len(REASONS_TABLE),
+        })
+        cleaned = clean_details(df)
+        kept = [(f'spotted {i}', label) for i, (_, label) in enumerate(REASONS_TABLE) if label]
+        self.assertEqual(list(zip(cleaned['message'], cleaned['reason'])), kept)
+        self.assertEqual(list(cleaned.index), list(range(len(kept))))
+
+
+class IterTrainingDataTests(TestCase):
+
+    def setUp(self):
+        create_dataset()
+        create_dataset(origin='outra')
+
+    def test_detailed_chunks_have_known_labels_only(self):
+        chunks = list(iter_training_data(detailed=True, chunk_size=2))
+        self.assertTrue(all(len(messages) <= 2 for messages, _ in chunks))
+        labels = sorted(label for _, labels in chunks for label in labels)
+        self.assertEqual(labels, ['Ofensivo', 'Spam', 'Spam'])
+
+    def test_binary_chunks_sample_the_approved_ones(self):
+        np.random.seed(0)
+        rows = [row for messages, labels in iter_training_data(chunk_size=2) for row in zip(messages, labels)]
+        labels = [label for _, label in rows]
+        self.assertEqual(labels.count('rejeitado'), 3)
+        self.assertLessEqual(labels.count('aprovado'), 6)
+
+        rows = [row for messages, labels in iter_training_data(ratio=10) for row in zip(messages, labels)]
+        self.assertEqual([label for _, label in rows].count('aprovado'), 6)
+
+
+def no_network(*args, **kwargs):
+    raise AssertionError("tried to use the network")
+
+
+class StopWordsTests(TemporaryStoreMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        helpers._read_stop_words.cache_clear()
+
+    def tearDown(self):
+        helpers._read_stop_words.cache_clear()
+        super().tearDown()
+
+    def test_fit_uses_the_packaged_revision_offline(self):
+        messages = ['linda gata', 'oi amor', 'compre spam', 'spam barato']
+        labels = ['aprovado', 'aprovado', 'rejeitado', 'rejeitado']
+        with mock.patch('requests.get', no_network), mock.patch.object(socket.socket, 'connect', no_network):
+            model = SpottedAnalyzer('nb').fit(messages, labels, reload=False)
+
+        path = os.path.join(STOPWORDS_DIR, settings.STOPWORDS_REVISION + '.txt')
+        with open(path, encoding='utf-8') as f:
+            packaged = f.read().split()
+        self.assertIn('de', packaged)
+        self.assertEqual(stop_words(), packaged)
+        self.assertEqual(model.pipeline.named_steps['vectorizer'].stop_words, packaged)
+
+    def test_unknown_revisions_are_not_downloaded(self):
+        with mock.patch('requests.get', no_network), override_settings(STOPWORDS_REVISION='0' * 40):
+            with self.assertRaises(FileNotFoundError):
+                stop_words()
+
+    def test_refresh_verifies_the_checksum(self):
+        content = 'de\na\no\n'.encode('utf-8')
+        response = mock.Mock(content=content, text=content.decode('utf-8'))
+        path = os.path.join(self.cache_dir, 'revision.txt')
+        with mock.patch('requests.get', return_value=response), mock.patch('processing.management.commands.refresh_stopwords.stop_words_path', return_value=path):
+            with self.assertRaises(CommandError):
+                call_command('refresh_stopwords', 'revision', '--sha256', '0' * 64, stdout=open(os.devnull, 'w'))
+            self.assertFalse(os.path.exists(path))
+
+            call_command('refresh_stopwords', 'revision', '--sha256', hashlib.sha256(content).hexdigest(), stdout=open(os.devnull, 'w'))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+
+
+class BuildPipelineTests(TestCase):
+
+    def test_every_kind_gives_probabilities(self):
+        messages = ['linda gata', 'oi amor', 'compre spam', 'spam barato', 'linda amor', 'spam agora']
+        labels = ['aprovado', 'aprovado', 'rejeitado', 'rejeitado', 'aprovado', 'rejeitado']
+        for kind in ('nb', 'svm', 'linear_svm', 'nb_online'):
+            with self.subTest(kind):
+                pipeline = build_pipeline(kind).fit(messages, labels)
+                self.assertEqual(pipeline.predict_proba(['spam linda']).shape, (1, 2))
+
+    def test_svm_is_the_calibrated_linear_svm(self):
+        self.assertIsInstance(build_classifier('svm'), CalibratedClassifierCV)
+        self.assertEqual(repr(build_classifier('svm')), repr(build_classifier('linear_svm')))
+        self.assertEqual(classifier_name('svm', detailed=True), classifier_name('linear_svm', detailed=True))
+
+    def test_benchmark_keeps_the_kernel_svc_baseline(self):
+        self.assertIsInstance(build_baseline('svc').named_steps['classifier'], SVC)
+        self.assertEqual(repr(build_baseline('nb')), repr(build_pipeline('nb')))
+
+
+class ClassifierAliasTests(TemporaryStoreMixin, TestCase):
+
+    def test_svm_loads_the_linear_svm_artifacts(self):
+        messages = ['linda gata', 'oi amor', 'compre spam', 'spam barato', 'linda amor', 'spam agora']
+        labels = ['aprovado', 'aprovado', 'rejeitado', 'rejeitado', 'aprovado', 'rejeitado']
+        save_classifier(build_pipeline('linear_svm').fit(messages, labels), 'linear_svm', False)
+
+        with mock.patch('processing.learning.build_pipeline', side_effect=AssertionError("svm was fitted")):
+            model = SpottedAnalyzer('svm').fit()
+        self.assertEqual(model.version, classifier_version('linear_svm'))
+
+
+MESSAGES = [
+    'linda gata do ciclo básico', 'oi amor amor amor te vi no bandejão', 'compre spam barato barato',
+    'spam agora compre', 'burro ofensivo idiota', 'linda linda gata da biblioteca', 'idiota burro',
+]
+LABELS = ['aprovado', 'aprovado', 'rejeitado', 'rejeitado', 'rejeitado', 'aprovado', 'rejeitado']
+REASONS = ['Spam', 'Spam', 'Ofensivo', 'Ofensivo']
+PROBES = ['linda linda gata', 'compre compre spam', 'burro gata', 'nada conhecido', '']
+
+
+class CompactArtifactTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_compact_pipelines_predict_like_sklearn(self):
+        variants = {
+            'default': {},
+            'binary': {'vectorizer__binary': True},
+            'sublinear_tf': {'tfidf__sublinear_tf': True},
+            'both': {'vectorizer__binary': True, 'tfidf__sublinear_tf': True, 'tfidf__norm': 'l1'},
+        }
+        for name, params in variants.items():
+            with self.subTest(name):
+                pipeline = build_pipeline('nb').set_params(**params).fit(MESSAGES, LABELS)
+                self.assertTrue(exportable(pipeline))
+                path = os.path.join(self.directory, name)
+                export_pipeline(pipeline, path)
+
+                compact = CompactModel(path)
+                np.testing.assert_allclose(compact.predict_proba(PROBES), pipeline.predict_proba(PROBES))
+                self.assertEqual(list(compact.predict(PROBES)), list(pipeline.predict(PROBES)))
+
+    def test_compact_combined_heads_predict_like_sklearn(self):
+        pipeline = build_pipeline('nb').set_params(tfidf__sublinear_tf=True)
+        features = Pipeline(pipeline.steps[:-1]).fit(MESSAGES)
+        rejected = [message for message, label in zip(MESSAGES, LABELS) if label == 'rejeitado']
+        combined = CombinedClassifier(features, {
+            'binary': MultinomialNB().fit(features.transform(MESSAGES), LABELS),
+            'detailed': MultinomialNB().fit(features.transform(rejected), REASONS),
+        })
+        self.assertTrue(combined.exportable())
+        combined.export(self.directory)
+
+        compact = CompactModel(self.directory)
+        for head in ('binary', 'detailed'):
+            with self.subTest(head):
+                np.testing.assert_allclose(compact.head_predict_proba(compact.features(PROBES), head), combined.head_predict_proba(combined.features(PROBES), head))
+                self.assertEqual(list(compact.head_predict(compact.features(PROBES), head)), list(combined.head_predict(combined.features(PROBES), head)))
+
+    def test_other_feature_steps_are_not_exported(self):
+        pipeline = build_pipeline('nb').set_params(vectorizer__analyzer='char', tfidf__use_idf=True).fit(MESSAGES, LABELS)
+        self.assertFalse(exportable(pipeline))
+        self.assertFalse(exportable(build_pipeline('linear_svm')))
+
+
+class OnlineFitTests(TemporaryStoreMixin, TestCase):
+
+    def test_streamed_fit_matches_a_fit_on_the_whole_dataset(self):
+        create_dataset()
+        model = SpottedAnalyzer('nb_online', detailed=True).fit(reload=False)
+
+        messages, labels = zip(*[row for chunk in iter_training_data(detailed=True) for row in zip(*chunk)])
+        expected = build_pipeline('nb_online')
+        expected.steps[-1] = ('classifier', MultinomialNB().partial_fit(expected.named_steps['vectorizer'].transform(messages), labels, classes=model.classes))
+
+        probe = ['compre spam', 'burro idiota']
+        np.testing.assert_allclose(model.transform(probe, prob=True), expected.predict_proba(probe))
+
+
+@override_settings(SPOTTED_CLASSIFIER='nb_online')
+class OnlineLearningTests(TemporaryStoreMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        create_dataset()
+        for detailed in (False, True):
+            SpottedAnalyzer('nb_online', detailed).fit()
+
+    def tearDown(self):
+        reset_models()
+        super().tearDown()
+
+    def class_counts(self, detailed):
+        classifier = SpottedAnalyzer('nb_online', detailed).fit().pipeline.named_steps['classifier']
+        return dict(zip(classifier.classes_, classifier.class_count_))
+
+    def test_learns_each_moderation_decision_once(self):
+        before = self.class_counts(False), self.class_counts(True)
+        Approved.objects.create(message='moderadores aprovaram')
+        Approved.objects.create(message='a api aprovou', by_api=True)
+        Rejected.objects.create(message='moderadores rejeitaram', reason='Spam')
+        Deleted.objects.create(message='apagado por ofensa', reason='Ofensivo ou Ódio', by='page')
+        Deleted.objects.create(message='apagado pelo autor', reason='Me arrependi', by='author')
+
+        self.assertEqual(learn(), {'classifier_nb_online': 3, 'classifier_nb_online_detailed': 2})
+        self.assertEqual(learn(), {'classifier_nb_online': 0, 'classifier_nb_online_detailed': 0})
+
+        binary, detailed = self.class_counts(False), self.class_counts(True)
+        self.assertEqual(binary['aprovado'] - before[0]['aprovado'], 1)
+        self.assertEqual(binary['rejeitado'] - before[0]['rejeitado'], 2)
+        self.assertEqual(detailed['Spam'] - before[1]['Spam'], 1)
+        self.assertEqual(detailed['Ofensivo'] - before[1]['Ofensivo'], 1)
+
+    def test_workers_reload_new_checkpoints(self):
+        resident = get_model('nb_online'), get_model('nb_online', detailed=True)
+        watcher = ModelWatcher()
+        self.assertEqual(watcher.check(), [])
+
+        Rejected.objects.create(message='moderadores rejeitaram', reason='Spam')
+        learn()
+        reloaded = watcher.check()
+
+        self.assertEqual([model.detailed for model in reloaded], [False, True])
+        self.assertIsNot(get_model('nb_online'), resident[0])
+        self.assertIsNot(get_model('nb_online', detailed=True), resident[1])
+        self.assertEqual(get_model('nb_online').version, classifier_version('nb_online'))
+
+
+@override_settings(SPOTTED_CLASSIFIER='nb')
+class PredictionCacheTests(TestCase):
+
+    def setUp(self):
+        self.previous_cache = cache._prediction_cache
+        self.cache = cache._prediction_cache = PredictionCache(LocalBackend(size=10, ttl=60))
+        messages = ['linda gata', 'oi amor', 'compre spam', 'burro idiota', 'linda amor', 'spam agora']
+        labels = ['aprovado', 'aprovado', 'rejeitado', 'rejeitado', 'aprovado', 'rejeitado']
+        reasons = ['Spam', 'Ofensivo', 'Spam']
+        for detailed, data in ((False, (messages, labels)), (True, ([m for m, l in zip(messages, labels) if l == 'rejeitado'], reasons))):
+            model = SpottedAnalyzer('nb', detailed)
+            model.pipeline, model.version = build_pipeline('nb').fit(*data), 'v1'
+            learning._models[('nb', detailed)] = model
+        learning._models[('nb', 'combined')] = False
+
+    def tearDown(self):
+        reset_models()
+        cache._prediction_cache = self.previous_cache
+
+    def test_repeated_spotteds_are_analysed_once(self):
+        with mock.patch.object(learning, '_analyse', wraps=learning._analyse) as analyse:
+            first = learning.spotted_analysis_batch(['Linda  gatá', 'compre spam', 'linda gata'])
+            second = learning.spotted_analysis_batch(['linda gata', 'COMPRE SPAM'])
+
+        analyse.assert_called_once_with(['Linda  gatá', 'compre spam'])
+        self.assertEqual(first[0], first[2])
+        self.assertEqual(second, [first[0], first[1]])
+        self.assertEqual(self.cache.stats(), {'hits': 2, 'misses': 3})
+
+    def test_new_model_versions_miss(self):
+        learning.spotted_analysis_batch(['linda gata'])
+        learning._models[('nb', False)].version = 'v2'
+        learning.spotted_analysis_batch(['linda gata'])
+        self.assertEqual(self.cache.stats(), {'hits': 0, 'misses': 2})
+
+    def test_local_backend_evicts_the_least_recently_used(self):
+        backend = LocalBackend(size=2, ttl=60)
+        backend.set_many({'a': 1, 'b': 2})
+        backend.get_many(['a'])
+        backend.set_many({'c': 3})
+        self.assertEqual(backend.get_many(['a', 'b', 'c']), {'a': 1, 'c': 3})
+
+        backend.ttl = -1
+        backend.set_many({'d': 4})
+        self.assertEqual(backend.get_many(['d']), {})
+
+
+class RetrainerTests(TemporaryStoreMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        for _ in range(3):
+            create_dataset()
+
+    def tearDown(self):
+        reset_models()
+        super().tearDown()
+
+    def retrain(self):
+        return Retrainer(workers=1, log=lambda line: None).run()
+
+    def test_every_kind_and_head_is_saved(self):
+        self.retrain()
+        for kind in DEFAULT_KINDS:
+            for detailed in (False, True):
+                with self.subTest(kind=kind, detailed=detailed):
+                    self.assertIsNotNone(classifier_version(kind, detailed))
+            self.assertEqual(classifier_version(kind, combined=True) is None, kind == 'nb_online')
+
+        # Every SPOTTED_CLASSIFIER is rebuilt, svm with linear_svm
+        with mock.patch('processing.learning.build_pipeline', side_effect=AssertionError("fitted in a request")):
+            for kind in ('nb', 'svm', 'linear_svm', 'nb_online'):
+                for detailed in (False, True):
+                    get_model(kind, detailed)
+
+    def test_online_checkpoints_learn_the_decisions_taken_while_retraining(self):
+        load = Retrainer.load
+
+        def load_and_moderate(retrainer):
+            load(retrainer)
+            Rejected.objects.create(message='rejeitado durante o treino', reason='Spam')
+
+        with mock.patch.object(Retrainer, 'load', load_and_moderate):
+            self.retrain()
+        self.assertEqual(learn('nb_online'), {'classifier_nb_online': 1, 'classifier_nb_online_detailed': 1})
+
+    def test_re_classify_rebuilds_the_default_kinds(self):
+        with mock.patch('processing.management.commands.re_classify.Retrainer') as retrainer:
+            call_command('re_classify', stdout=open(os.devnull, 'w'))
+        self.assertEqual(retrainer.call_args[1]['kinds'], list(DEFAULT_KINDS))
+
+
+class CombinedModelTests(TemporaryStoreMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        for _ in range(3):
+            create_dataset()
+        Retrainer(kinds=('nb', 'linear_svm'), workers=1, log=lambda line: None).run()
+        reset_models()
+        self.previous_cache = cache._prediction_cache
+        cache._prediction_cache = PredictionCache()
+
+    def tearDown(self):
+        reset_models()
+        cache._prediction_cache = self.previous_cache
+        super().tearDown()
+
+    def test_combined_heads_answer_like_the_separate_models(self):
+        spotteds = ['linda gata amor', 'compre spam barato', 'burro ofensivo idiota', 'nada conhecido']
+        for kind, compact in (('nb', True), ('linear_svm', False)):
+            with self.subTest(kind), override_settings(SPOTTED_CLASSIFIER=kind):
+                self.assertIsInstance(learning.get_combined_model(), CompactModel if compact else CombinedClassifier)
+                separate, combined = learning._analyse(spotteds), learning._analyse_combined(spotteds)
+                self.assertEqual([result[:2] for result in combined], [result[:2] for result in separate])
+                np.testing.assert_allclose([result[2] for result in combined], [result[2] for result in separate])
+
+                with mock.patch.object(learning, '_analyse', side_effect=AssertionError("used the separate models")):
+                    self.assertEqual(learning.spotted_analysis_batch(spotteds), combined)
+
+
+class ArtifactStoreTests(TestCase):
+
+    def setUp(self):
+        self.remote_dir = tempfile.mkdtemp()
+        self.cache_dirs = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+        backend = storage.DirectoryBackend(self.remote_dir)
+        self.publisher, self.worker = [storage.ArtifactStore(backend, cache_dir=cache_dir) for cache_dir in self.cache_dirs]
+
+    def tearDown(self):
+        for directory in [self.remote_dir] + self.cache_dirs:
+            shutil.rmtree(directory)
+
+    def publish(self, content):
+        with open(self.publisher.local_path('model.pkl'), 'wb') as f:
+            f.write(content)
+        return self.publisher.publish('model', ['model.pkl'])
+
+    def test_sync_downloads_new_versions_only(self):
+        version = self.publish(b'first')
+        self.assertEqual(self.worker.sync('model'), version)
+        with open(self.worker.local_path('model.pkl'), 'rb') as f:
+            self.assertEqual(f.read(), b'first')
+
+        with mock.patch.object(self.worker.backend, 'download') as download:
+            self.assertEqual(self.worker.sync('model'), version)
+        download.assert_not_called()
+
+        self.assertNotEqual(self.publish(b'second'), version)
+        self.worker.sync('model')
+        with open(self.worker.local_path('model.pkl'), 'rb') as f:
+            self.assertEqual(f.read(), b'second')
+        self.assertEqual(sorted(os.listdir(self.cache_dirs[1])), ['model.json', 'model.pkl'])
+
+    def test_failed_download_keeps_the_local_copy(self):
+        version = self.publish(b'first')
+        self.worker.sync('model')
+        self.publish(b'second')
+
+        with mock.patch.object(self.worker.backend, 'download', side_effect=IOError):
+            with self.assertRaises(IOError):
+                self.worker.sync('model')
+        self.assertEqual(self.worker.version('model'), version)
+        self.assertEqual(sorted(os.listdir(self.cache_dirs[1])), ['model.json', 'model.pkl'])
+
+    def test_sync_classifiers_can_fail_silently(self):
+        previous, storage._store = storage._store, self.worker
+        try:
+            with mock.patch.object(self.worker, 'sync', side_effect=IOError):
+                with self.assertRaises(IOError):
+                    sync_classifiers(['nb'])
+                with self.assertLogs('processing.helpers', 'ERROR'):
+                    sync_classifiers(['nb'], fail_silently=True)
+        finally:
+            storage._store = previous
+
+
+@override_settings(DUPLICATE_THRESHOLD=0.8)
+class DuplicateIndexTests(TestCase):
+
+    def setUp(self):
+        self.index = duplicates._index = DuplicateIndex()
+
+    def tearDown(self):
+        duplicates._index = None
+
+    def test_rows_saved_here_are_not_indexed_again_by_refresh(self):
+        self.index.refresh()
+        first = Approved.objects.create(message='alguém viu a menina de vestido azul no bandejão hoje?')
+        Approved.objects.bulk_create([Approved(message='perdi meu guarda-chuva preto no ciclo básico')])
+        self.index.refresh()
+
+        self.assertEqual(len(self.index), 2)
+        self.assertEqual(self.index.query('Alguém viu a menina de vestido azul no bandejão hoje??')[:2], (Approved, first.id))
+        self.assertEqual(self.index.added, set())
+
+        self.index.refresh()
+        self.assertEqual(len(self.index), 2)
+
+    def test_bulk_created_rows_are_indexed_where_they_are_written(self):
+        self.index.refresh()
+        rejected = Rejected(id=50, message='compre já o seu ingresso para a festa de sexta', reason='Spam', origin='spottedunicamp')
+        write_rows([('datasets.Rejected', {f.attname: getattr(rejected, f.attname) for f in Rejected._meta.concrete_fields if f.name != 'created'})])
+
+        self.assertEqual(self.index.query('compre ja o seu ingresso para a festa de sexta!')[:2], (Rejected, 50))
+        self.index.refresh()
+        self.assertEqual(len(self.index), 1)
+
+    def test_merged_arrays_stay_sorted(self):
+        messages = [f'spotted numero {i} sobre a festa da computação' for i in range(30)]
+        for start in range(0, 30, 7):
+            block = list(range(start, min(start + 7, 30)))
+            self.index.extend(np.zeros(len(block), dtype=np.uint8), np.array(block, dtype=np.int64), np.array([duplicates.signature(messages[i]) for i in block]))
+
+        keys = duplicates.band_keys(self.index.signatures).T
+        self.assertTrue((np.diff(self.index.keys.astype(np.int64), axis=1) >= 0).all())
+        np.testing.assert_array_equal(self.index.keys, keys[np.arange(duplicates.BANDS)[:, None], self.index.entries])
+        for i, message in enumerate(messages):
+            self.assertEqual(self.index.query(message), (Approved, i, 1.0))
+
+    def test_compact_drops_removed_entries(self):
+        approved = [Approved.objects.create(message=f'o spotted de numero {i} fala do bandejão') for i in range(3)]
+        removed = approved[1].id
+        approved[1].delete()
+        self.assertEqual(self.index.removed, {(0, removed)})
+
+        self.index.compact()
+        self.assertEqual(self.index.removed, set())
+        self.assertEqual(sorted(self.index.ids.tolist()), [approved[0].id, approved[2].id])
+        self.assertIsNone(self.index.query(approved[1].message, threshold=1.0))
+
+    @override_settings(DUPLICATE_INDEX_PATH='/nonexistent/duplicates.npz')
+    def test_without_a_snapshot_only_new_spotteds_are_indexed(self):
+        duplicates._index = None
+        Approved.objects.create(message='um spotted antigo sobre o bandejão')
+        with mock.patch.object(DuplicateIndex, 'refresh_every', lambda index, interval: index), self.assertLogs('processing.duplicates', 'WARNING'):
+            index = duplicates.get_duplicate_index()
+        index.refresh()
+        self.assertEqual(len(index), 0)
+
+        Approved.objects.create(message='um spotted novo sobre o bandejão')
+        self.assertEqual(len(index), 1)
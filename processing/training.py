@@ -0,0 +1,130 @@
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+from sklearn.pipeline import Pipeline
+
+from .artifacts import CombinedClassifier
+from .helpers import get_data, merge_data, moderation_positions, rand_reindex, save_classifier, save_combined
+from .learning import ONLINE_CLASSIFIERS, SpottedAnalyzer, build_pipeline
+
+
+# Kinds rebuilt by re_classify, svm being another name for linear_svm
+DEFAULT_KINDS = ('nb', 'linear_svm', 'nb_online')
+
+
+def peak_memory(children=False):
+    """Peak Memory
+    returns the peak resident memory in MB of this process or of its finished children
+    """
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    return usage.ru_maxrss / 1024
+
+
+def _fit(name, estimator, features, labels, classes=None):
+    """Fits one classifier, inside a pool worker."""
+    start = time.perf_counter()
+    if classes is None:
+        estimator.fit(features, labels)
+    else:
+        estimator.partial_fit(features, labels, classes=classes)
+    return name, estimator, time.perf_counter() - start, peak_memory()
+
+
+class Retrainer(object):
+    """Retrainer
+    rebuilds every classifier from a single load of the dataset
+
+    the vectorizer is fitted once and its matrices are shared by all the
+    classifiers of the same family, which are then trained in parallel.
+    The binary and detailed classifiers of each kind are also saved as a
+    single combined classifier
+    """
+
+    def __init__(self, kinds=DEFAULT_KINDS, workers=None, log=print):
+        self.kinds = kinds
+        self.workers = workers
+        self.log = log
+        self.timings = []
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        yield
+        self.record(name, time.perf_counter() - start, peak_memory())
+
+    def record(self, name, seconds, memory):
+        self.timings.append((name, seconds, memory))
+        self.log(f"{name:<28} {seconds:>8.2f}s {memory:>10.1f}MB")
+
+    def load(self):
+        """Loads the binary and the detailed datasets, reading rejected spotteds once.
+
+        online classifiers keep learning from the decisions taken after
+        the positions recorded here, before the datasets are read
+        """
+        self.positions = moderation_positions()
+        rejected = get_data(False, True)
+        self.detailed = rand_reindex(rejected)
+        self.binary = merge_data(get_data(), rejected.assign(reason='rejeitado'))
+
+    def vectorize(self, pipeline):
+        """Fits the feature steps of a pipeline on the binary dataset and transforms both datasets."""
+        features = Pipeline(pipeline.steps[:-1])
+        return features, features.fit_transform(self.binary['message']), features.transform(self.detailed['message'])
+
+    def jobs(self):
+        """Yields (kind, detailed, features step, estimator, matrix, labels, classes)."""
+        families = {}
+        for kind in self.kinds:
+            pipeline = build_pipeline(kind)
+            family = type(pipeline.named_steps['vectorizer'])
+            if family not in families:
+                with self.stage(f"vectorize {family.__name__}"):
+                    families[family] = self.vectorize(pipeline)
+            features, binary, detailed = families[family]
+
+            for is_detailed, matrix, labels in ((False, binary, self.binary['reason']), (True, detailed, self.detailed['reason'])):
+                analyzer = SpottedAnalyzer(kind, is_detailed)
+                estimator = build_pipeline(kind).steps[-1][1]
+                classes = analyzer.classes if analyzer.online else None
+                yield kind, is_detailed, features, estimator, matrix, labels, classes
+
+    def run(self):
+        start = time.perf_counter()
+
+        with self.stage("load"):
+            self.load()
+
+        jobs = {}
+        with ProcessPoolExecutor(self.workers) as pool:
+            futures = []
+            for kind, detailed, features, estimator, matrix, labels, classes in self.jobs():
+                name = kind + ('_detailed' if detailed else '')
+                jobs[name] = (kind, detailed, features)
+                futures.append(pool.submit(_fit, name, estimator, matrix, labels, classes))
+
+            with self.stage("train"):
+                results = [future.result() for future in futures]
+
+        for name, estimator, seconds, memory in results:
+            self.record(f"  fit {name}", seconds, memory)
+
+        with self.stage("save"):
+            heads = {}
+            for name, estimator, _, _ in results:
+                kind, detailed, features = jobs[name]
+                pipeline = Pipeline(features.steps + [('classifier', estimator)])
+                if kind in ONLINE_CLASSIFIERS:
+                    pipeline.learned_positions = self.positions
+                save_classifier(pipeline, kind, detailed)
+                heads.setdefault(kind, (features, {}))[1]['detailed' if detailed else 'binary'] = estimator
+
+            # Both heads of a kind share its features, save them together too
+            for kind, (features, estimators) in heads.items():
+                if kind not in ONLINE_CLASSIFIERS:
+                    save_combined(CombinedClassifier(features, estimators), kind)
+
+        self.record("total", time.perf_counter() - start, max(peak_memory(), peak_memory(children=True)))
+        return self
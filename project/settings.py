@@ -157,8 +157,11 @@ REST_FRAMEWORK = {
     'DEFAULT_THROTTLE_RATES': {
         'process_chat_message': '1000/day',
         'chatsubmit': '1000/day',
+        'chatsubmit_batch': '1000/day',
         'list': '1000/day',
+        'export': '100/day',
         'new_spotted': '1000/day',
+        'new_spotted_batch': '100/day',
         'approved_spotted': '1000/day',
         'rejected_spotted': '1000/day',
         'deleted_spotted': '1000/day',
@@ -174,6 +177,56 @@ S3_KEY = str(os.environ.get('S3_KEY'))
 S3_SECRET = str(os.environ.get('S3_SECRET'))
 S3_BUCKET = str(os.environ.get('S3_BUCKET'))
 
+# Where classifiers are published: 's3', 'local' or a directory standing in for the bucket.
+# Without S3 credentials they are only kept locally
+CLASSIFIER_STORE = os.environ.get('CLASSIFIER_STORE', 's3' if os.environ.get('S3_KEY') else 'local')
+
+# Download new classifiers when each worker boots, keeping the local ones if that fails
+SYNC_CLASSIFIERS = eval(os.environ.get('SYNC_CLASSIFIERS', 'True').capitalize())
+
+
+# Classifiers
+# Classifier used to analyse new spotteds: 'nb', 'linear_svm' (or 'svm') or 'nb_online', which keeps learning from moderation
+SPOTTED_CLASSIFIER = os.environ.get('SPOTTED_CLASSIFIER', 'nb')
+
+# Online learning: moderated spotteds per partial_fit in learn_online, and
+# seconds between checks of the workers for a new checkpoint
+ONLINE_BATCH_SIZE = int(os.environ.get('ONLINE_BATCH_SIZE', 1000))
+ONLINE_RELOAD_INTERVAL = int(os.environ.get('ONLINE_RELOAD_INTERVAL', 60))
+
+# Load the classifiers when each worker boots
+PRELOAD_CLASSIFIERS = eval(os.environ.get('PRELOAD_CLASSIFIERS', 'True').capitalize())
+
+# Cache of analysed spotteds: 'local' (per worker), 'django' (the PREDICTION_CACHE_ALIAS cache) or 'none'
+PREDICTION_CACHE = os.environ.get('PREDICTION_CACHE', 'local')
+PREDICTION_CACHE_ALIAS = os.environ.get('PREDICTION_CACHE_ALIAS', 'default')
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 10000))
+PREDICTION_CACHE_TTL = int(os.environ.get('PREDICTION_CACHE_TTL', 24 * 60 * 60))
+
+# Near-duplicate detection of new spotteds
+DUPLICATE_DETECTION = eval(os.environ.get('DUPLICATE_DETECTION', 'True').capitalize())
+DUPLICATE_THRESHOLD = float(os.environ.get('DUPLICATE_THRESHOLD', 0.8))
+DUPLICATE_INDEX_PATH = os.environ.get('DUPLICATE_INDEX_PATH', 'processing/indexes/duplicates.npz')
+DUPLICATE_INDEX_REFRESH = int(os.environ.get('DUPLICATE_INDEX_REFRESH', 60))
+
+# Chatbot replies: the engine saved by rebuild_chat_engine and the similarity a reply needs
+CHAT_ENGINE_PATH = os.environ.get('CHAT_ENGINE_PATH', 'processing/indexes/chat_engine.pkl')
+CHAT_ENGINE_THRESHOLD = float(os.environ.get('CHAT_ENGINE_THRESHOLD', 0.3))
+# Load the chat engine when each worker boots
+CHAT_ENGINE_PRELOAD = eval(os.environ.get('CHAT_ENGINE_PRELOAD', 'True').capitalize())
+
+# Revision of the stopword list bundled in processing/stopwords
+STOPWORDS_REVISION = os.environ.get('STOPWORDS_REVISION', '2107d809cca6b83ce3d8e04dbd9463283025284f')
+
+
+# Deferred writes of new spotteds: answer right away and write them from a
+# background thread, through a local spool. Needs PostgreSQL, whose sequences
+# give the ids of the spotteds before they are written
+DEFERRED_WRITES = eval(os.environ.get('DEFERRED_WRITES', 'False').capitalize())
+DEFERRED_WRITES_SPOOL = os.environ.get('DEFERRED_WRITES_SPOOL', os.path.join(BASE_DIR, 'deferred_writes.sqlite3'))
+DEFERRED_WRITES_BATCH = int(os.environ.get('DEFERRED_WRITES_BATCH', 500))
+DEFERRED_WRITES_INTERVAL = float(os.environ.get('DEFERRED_WRITES_INTERVAL', 1))
+
 
 # Error report emails
 DEFAULT_FROM_EMAIL = str(os.environ.get('EMAIL_ACCOUNT'))
@@ -10,8 +10,31 @@ https://docs.djangoproject.com/en/1.6/howto/deployment/wsgi/
 import os
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings")
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 from whitenoise.django import DjangoWhiteNoise
 
 application = get_wsgi_application()
+
+# Download new classifiers and load them once per worker instead of on the first request
+if settings.SYNC_CLASSIFIERS:
+    from processing.helpers import sync_classifiers
+    sync_classifiers(fail_silently=True)
+
+if settings.PRELOAD_CLASSIFIERS:
+    from processing.learning import load_models
+    load_models()
+
+# Online classifiers are trained by learn_online, workers only reload them
+from processing.online import watch_models
+watch_models()
+
+if settings.DUPLICATE_DETECTION:
+    from processing.duplicates import get_duplicate_index
+    get_duplicate_index()
+
+if settings.CHAT_ENGINE_PRELOAD:
+    from chatbot.engine import get_chat_engine
+    get_chat_engine()
+
 application = DjangoWhiteNoise(application)
\ No newline at end of file